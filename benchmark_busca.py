@@ -0,0 +1,100 @@
+"""
+Benchmark da busca do NayEmail
+Compara a varredura original (`query in texto` em todos os emails) com o
+índice de trigramas e o índice invertido, e confere que os trigramas devolvem
+exatamente os mesmos resultados da varredura.
+
+Uso: python benchmark_busca.py [quantidade_de_emails] [quantidade_de_usuarios]
+"""
+
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from search import InvertedIndex, TrigramIndex, email_contains
+
+WORDS = [
+    'verificação', 'código', 'senha', 'reunião', 'amanhã', 'projeto', 'relatório',
+    'conta', 'acesso', 'segurança', 'pagamento', 'fatura', 'pedido', 'entrega',
+    'suporte', 'atendimento', 'token', 'sistema', 'notificação', 'convite'
+]
+SITES = ['lojaexemplo', 'bancodigital', 'redesocial', 'streaming', 'marketplace']
+
+
+def generate_emails(total, users):
+    """Gera emails sintéticos parecidos com os do sistema"""
+    now = datetime.now()
+    emails = []
+    for i in range(total):
+        code = f"{random.randrange(10**6):06d}"
+        site = random.choice(SITES)
+        body = ' '.join(random.choices(WORDS, k=40)) + f"\nCódigo: {code}\nID: {uuid.uuid4().hex[:8]}"
+        emails.append({
+            'id': str(uuid.uuid4()),
+            'from': f"verificacao@{site}.nay.com",
+            'to': random.choice(users),
+            'subject': f"🔐 {random.choice(WORDS).title()} - {site}",
+            'body': body,
+            'date': (now - timedelta(minutes=i)).isoformat()
+        })
+    return emails
+
+
+def scan(emails, user_email, query):
+    """Busca original: varre todos os emails do sistema"""
+    query = query.lower()
+    return [e for e in emails
+            if (e.get('to') == user_email or e.get('from') == user_email) and email_contains(e, query)]
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    users = [f"usuario{i}@nayemail.com" for i in range(user_count)]
+
+    print(f"📧 Gerando {total} emails para {user_count} usuários...")
+    emails = generate_emails(total, users)
+    by_id = {e['id']: e for e in emails}
+
+    start = time.perf_counter()
+    trigram_index = TrigramIndex()
+    trigram_index.add_many(emails)
+    print(f"🔧 Índice de trigramas: {(time.perf_counter() - start):.2f}s")
+
+    start = time.perf_counter()
+    word_index = InvertedIndex()
+    word_index.add_many(emails)
+    print(f"🔧 Índice invertido: {(time.perf_counter() - start):.2f}s")
+
+    sample = random.choice([e for e in emails if e['to'] == users[0]])
+    queries = ['verificação', 'reunião amanhã', sample['body'][-8:], 'ID: ', 'bancodig', 'zzzz']
+
+    print(f"\n{'consulta':<20} {'varredura':>12} {'trigramas':>12} {'palavras':>12}  resultados")
+    for query in queries:
+        scan_ms, expected = timed(lambda: scan(emails, users[0], query), 5)
+
+        def trigram_search():
+            ids = trigram_index.candidates(users[0], query.lower())
+            candidates = (by_id[i] for i in ids) if ids is not None else emails
+            return [e for e in candidates
+                    if (e.get('to') == users[0] or e.get('from') == users[0]) and email_contains(e, query.lower())]
+
+        trigram_ms, found = timed(trigram_search, 5)
+        word_ms, word_ids = timed(lambda: word_index.search(users[0], query), 5)
+
+        same = sorted(e['id'] for e in found) == sorted(e['id'] for e in expected)
+        print(f"{query!r:<20} {scan_ms:>10.2f}ms {trigram_ms:>10.2f}ms {word_ms:>10.2f}ms  "
+              f"{len(expected)} {'✅' if same else '❌ DIVERGENTE'} (palavras: {len(word_ids or ())})")
+
+
+if __name__ == '__main__':
+    main()
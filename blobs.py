@@ -0,0 +1,164 @@
+"""
+NayEmail - Armazenamento dos corpos dos emails
+Corpos deduplicados por hash do conteúdo (BodyPool), opcionalmente num arquivo
+append-only lido via mmap (BlobStore): os registros apontam para a entrada
+compartilhada e o texto é lido quando alguém pede 'body'. O arquivo é só um
+cache do processo, fora do heap do Python: o storage continua gravando o corpo
+junto com o email e a carga reconstrói o arquivo
+"""
+
+import hashlib
+import mmap
+import tempfile
+import threading
+
+
+class BlobStore:
+    """Blobs UTF-8 num arquivo append-only; referência = (offset << 32) | tamanho"""
+
+    LENGTH_BITS = 32
+
+    def __init__(self, directory=None):
+        # Arquivo anônimo: some ao fechar e não é compartilhado com outros processos
+        # (o reloader do Flask importa o servidor duas vezes)
+        self.directory = directory
+        self.file = tempfile.TemporaryFile(prefix='nayemail-bodies-', dir=directory)
+        self.size = 0
+        self.map = None
+        self.lock = threading.Lock()
+        self.stats = {'blobs': 0, 'bytes': 0, 'reads': 0}
+
+    def append(self, text):
+        """Grava o texto no final do arquivo e devolve a referência"""
+        data = text.encode('utf-8')
+        if len(data) >> self.LENGTH_BITS:
+            raise ValueError('Corpo grande demais para o armazenamento de blobs')
+
+        with self.lock:
+            offset = self.size
+            self.file.seek(offset)
+            self.file.write(data)
+            self.size += len(data)
+            self.stats['blobs'] += 1
+            self.stats['bytes'] += len(data)
+        return (offset << self.LENGTH_BITS) | len(data)
+
+    def read(self, ref):
+        """Texto do blob, decodificado direto do mapeamento"""
+        offset, length = ref >> self.LENGTH_BITS, ref & ((1 << self.LENGTH_BITS) - 1)
+        if length == 0:
+            return ''
+
+        with self.lock:
+            if self.map is None or offset + length > len(self.map):
+                # O arquivo cresceu desde o último mapeamento
+                self.file.flush()
+                self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+            self.stats['reads'] += 1
+            with memoryview(self.map)[offset:offset + length] as data:
+                return str(data, 'utf-8')
+
+
+class BodyEntry:
+    """Corpo compartilhado por todas as mensagens com o mesmo conteúdo"""
+
+    __slots__ = ('digest', 'text', 'ref', 'size', 'refs')
+
+    def __init__(self, digest, size):
+        self.digest = digest
+        self.text = None   # texto em memória (sem BlobStore)
+        self.ref = None    # referência no BlobStore
+        self.size = size   # bytes UTF-8
+        self.refs = 0
+
+
+class BodyPool:
+    """Corpos deduplicados por hash do conteúdo, com contagem de referências.
+    Sem BlobStore o texto fica no BodyEntry; com ele, no arquivo mapeado"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self.entries = {}   # digest -> BodyEntry
+        self.lock = threading.Lock()
+        self.dead_bytes = 0   # bytes de corpos liberados ainda no arquivo de blobs
+        self.stats = {'stored': 0, 'deduplicated': 0, 'released': 0, 'compactions': 0}
+
+    def clear(self):
+        """Esvazia o pool (recarga completa dos emails)"""
+        with self.lock:
+            self.entries = {}
+            if self.store is not None:
+                self.store = BlobStore(self.store.directory)
+            self.dead_bytes = 0
+
+    def acquire(self, text):
+        """Entrada do corpo (criada na primeira ocorrência) com mais uma referência"""
+        data = text.encode('utf-8')
+        digest = hashlib.blake2b(data, digest_size=20).digest()
+
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                entry = self.entries[digest] = BodyEntry(digest, len(data))
+                if self.store is not None:
+                    entry.ref = self.store.append(text)
+                else:
+                    entry.text = text
+                self.stats['stored'] += 1
+            else:
+                self.stats['deduplicated'] += 1
+            entry.refs += 1
+        return entry
+
+    def release(self, entry):
+        """Tira uma referência; sem referências o corpo sai do pool"""
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            if self.entries.get(entry.digest) is entry:
+                del self.entries[entry.digest]
+            if entry.ref is not None:
+                self.dead_bytes += entry.size
+            self.stats['released'] += 1
+
+    def read(self, entry):
+        if entry.text is not None:
+            return entry.text
+        # Loja e referência lidas juntas: compact() troca as duas sob o mesmo lock
+        with self.lock:
+            return self.store.read(entry.ref)
+
+    def needs_compaction(self):
+        return self.store is not None and self.dead_bytes > max(self.store.size // 2, 1024 * 1024)
+
+    def compact(self):
+        """Regrava o arquivo de blobs só com os corpos ainda referenciados"""
+        if self.store is None:
+            return
+
+        with self.lock:
+            # Novas referências montadas à parte; entradas e loja trocam juntas no fim
+            store = BlobStore(self.store.directory)
+            refs = [(entry, store.append(self.store.read(entry.ref))) for entry in self.entries.values()]
+            for entry, ref in refs:
+                entry.ref = ref
+            self.store = store
+            self.dead_bytes = 0
+            self.stats['compactions'] += 1
+
+    def summary(self):
+        """Espaço ocupado e economizado pela deduplicação"""
+        with self.lock:
+            stored = sum(entry.size for entry in self.entries.values())
+            logical = sum(entry.size * entry.refs for entry in self.entries.values())
+            references = sum(entry.refs for entry in self.entries.values())
+        return {
+            'unique_bodies': len(self.entries),
+            'references': references,
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'saved_bytes': logical - stored,
+            'dead_bytes': self.dead_bytes,
+            **self.stats
+        }
@@ -0,0 +1,141 @@
+"""
+NayEmail - Espelho colunar dos metadados dos emails
+Remetente/destinatário internados, pasta, flags e data (epoch µs) em arrays
+NumPy alinhados às posições de emails_db, para filtros, contagens e ordenação
+por data vetorizados nas visões administrativas. NumPy é opcional: sem ele o
+servidor continua com as varreduras em Python
+"""
+
+from records import addresses as shared_addresses, parse_timestamp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+available = np is not None
+
+# Bits da coluna de flags
+FLAG_READ = 1 << 0
+FLAG_STARRED = 1 << 1
+FLAG_HIGHLIGHTED = 1 << 2
+FLAG_VERIFICATION = 1 << 3
+FLAG_PASSWORD_RESET = 1 << 4
+FLAG_NOTIFICATION = 1 << 5
+FLAG_LOG = 1 << 6   # '[LOG]' no assunto (logs do sistema)
+
+FLAG_FIELDS = {
+    'read': FLAG_READ,
+    'starred': FLAG_STARRED,
+    'highlighted': FLAG_HIGHLIGHTED,
+    'verification': FLAG_VERIFICATION,
+    'password_reset': FLAG_PASSWORD_RESET,
+    'notification': FLAG_NOTIFICATION
+}
+
+# Campos do email que alteram alguma coluna
+COLUMN_FIELDS = {'from', 'to', 'folder', 'date', 'subject'} | set(FLAG_FIELDS)
+
+
+def email_timestamp(email):
+    """Data do email em microssegundos desde 1970 (-1 se ausente ou inválida)"""
+    timestamp = email.timestamp() if hasattr(email, 'timestamp') else None
+    if timestamp is None:
+        timestamp = parse_timestamp(email.get('date'))
+    return -1 if timestamp is None else timestamp
+
+
+class ColumnStore:
+    """Colunas paralelas a emails_db (linha = posição); linhas de tombstones
+    ficam com alive=False até a próxima reconstrução"""
+
+    def __init__(self, capacity=1024, addresses=shared_addresses):
+        self.addresses = addresses   # códigos de endereços e pastas (records.AddressBook)
+        self.size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.sender = np.zeros(capacity, dtype=np.int32)
+        self.recipient = np.zeros(capacity, dtype=np.int32)
+        self.folder = np.zeros(capacity, dtype=np.int32)
+        self.flags = np.zeros(capacity, dtype=np.uint16)
+        self.date = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self, needed):
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('alive', 'sender', 'recipient', 'folder', 'flags', 'date'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def clear(self):
+        self.size = 0
+        self.alive[:] = False
+
+    def intern(self, value):
+        """Código de uma string (endereço ou pasta); -1 para valores ausentes"""
+        return self.addresses.code(value)
+
+    def code(self, value):
+        """Código já internado (sem criar); None se a string nunca apareceu"""
+        return self.addresses.code(value, create=False)
+
+    def set_row(self, position, email):
+        """Grava (ou regrava) os metadados de um email na linha da sua posição"""
+        self._grow(position + 1)
+        self.size = max(self.size, position + 1)
+
+        flags = 0
+        for field, bit in FLAG_FIELDS.items():
+            if email.get(field):
+                flags |= bit
+        if '[LOG]' in (email.get('subject') or ''):
+            flags |= FLAG_LOG
+
+        self.alive[position] = True
+        self.sender[position] = self.intern(email.get('from'))
+        self.recipient[position] = self.intern(email.get('to'))
+        self.folder[position] = self.intern(email.get('folder'))
+        self.flags[position] = flags
+        self.date[position] = email_timestamp(email)
+
+    def set_rows(self, start, emails):
+        """Carga em lote a partir de uma posição (None = tombstone)"""
+        self._grow(start + len(emails))
+        for offset, email in enumerate(emails):
+            if email is None:
+                self.alive[start + offset] = False
+            else:
+                self.set_row(start + offset, email)
+        self.size = max(self.size, start + len(emails))
+
+    def clear_row(self, position):
+        if position < self.size:
+            self.alive[position] = False
+
+    # Consultas vetorizadas: máscaras sobre as linhas ativas
+    def mask(self):
+        return self.alive[:self.size].copy()
+
+    def has_flag(self, bit):
+        return (self.flags[:self.size] & bit) != 0
+
+    def equals(self, column, value):
+        """Máscara column == value (value é a string original)"""
+        code = self.code(value)
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return getattr(self, column)[:self.size] == code
+
+    def newest_first(self, mask):
+        """Posições que passam na máscara, da data mais recente para a mais antiga
+        (empates na ordem de emails_db, como o sorted(reverse=True) original)"""
+        positions = np.flatnonzero(mask)
+        order = np.argsort(-self.date[positions], kind='stable')
+        return positions[order].tolist()
@@ -0,0 +1,100 @@
+"""
+NayEmail - Eventos ao vivo das caixas postais (Server-Sent Events)
+O EventHub distribui cada evento só para as conexões do usuário afetado. Cada
+conexão é um Subscriber com uma fila curta e um threading.Event: conexões
+ociosas ficam bloqueadas sem consumir CPU e nenhuma varredura é feita para
+descobrir o que mudou. Quem fica para trás recebe 'resync' e recarrega tudo
+"""
+
+import json
+import threading
+from collections import deque
+
+
+class Subscriber:
+    """Uma conexão de eventos de um usuário"""
+
+    __slots__ = ('user_email', 'queue', 'ready', 'overflowed')
+
+    def __init__(self, user_email, max_queue):
+        self.user_email = user_email
+        self.queue = deque(maxlen=max_queue)
+        self.ready = threading.Event()
+        self.overflowed = False
+
+    def push(self, event):
+        if len(self.queue) == self.queue.maxlen:
+            self.overflowed = True
+        self.queue.append(event)
+        self.ready.set()
+
+    def wait(self, timeout):
+        """Eventos pendentes (espera até timeout); lista vazia se nada chegou"""
+        if not self.ready.wait(timeout):
+            return []
+        self.ready.clear()
+
+        events = []
+        while self.queue:
+            events.append(self.queue.popleft())
+        if self.overflowed:
+            # Fila estourou: os eventos guardados não bastam, o cliente recarrega tudo
+            self.overflowed = False
+            return [(events[-1][0], 'resync', {})] if events else []
+        return events
+
+
+class EventHub:
+    """Assinaturas por usuário; publish() entrega o evento só às conexões dele"""
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.channels = {}   # email -> [Subscriber]
+        self.sequence = 0    # id dos eventos (campo id: do SSE)
+        self.stats = {'published': 0, 'delivered': 0, 'connections': 0}
+
+    def subscribe(self, user_email):
+        subscriber = Subscriber(user_email, self.max_queue)
+        with self.lock:
+            self.channels.setdefault(user_email, []).append(subscriber)
+            self.stats['connections'] += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            channel = self.channels.get(subscriber.user_email, [])
+            if subscriber in channel:
+                channel.remove(subscriber)
+                self.stats['connections'] -= 1
+            if not channel:
+                self.channels.pop(subscriber.user_email, None)
+
+    def listeners(self):
+        """Usuários com pelo menos uma conexão aberta"""
+        with self.lock:
+            return list(self.channels)
+
+    def publish(self, user_emails, name, data):
+        """Entrega o evento às conexões de cada usuário da lista"""
+        if not self.channels:
+            return
+
+        with self.lock:
+            self.sequence += 1
+            event = (self.sequence, name, data)
+            self.stats['published'] += 1
+            for user_email in set(user_emails):
+                for subscriber in self.channels.get(user_email, ()):
+                    subscriber.push(event)
+                    self.stats['delivered'] += 1
+
+    def summary(self):
+        with self.lock:
+            return {'users': len(self.channels), **self.stats}
+
+
+def format_event(event):
+    """Evento no formato text/event-stream"""
+    sequence, name, data = event
+    return f"id: {sequence}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,72 @@
+"""
+NayEmail - Cache dos emails já serializados
+Guarda o JSON (bytes) de cada email, descartado quando o registro muda
+(records.EmailRecord avisa o cache), para que as listagens só concatenem os
+fragmentos em vez de serializar de novo os mesmos emails a cada consulta.
+Limitado em bytes, descartando os menos usados
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """id do email -> (registro, JSON em bytes), em ordem de uso (LRU)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, record):
+        """Fragmento guardado para este registro; None se não há (ou é de outro registro com o mesmo id)"""
+        with self.lock:
+            entry = self.entries.get(record.id)
+            if entry is None or entry[0] is not record:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(record.id)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, record, fragment):
+        """Guarda o fragmento; False se ele sozinho não cabe no cache"""
+        if len(fragment) > self.max_bytes:
+            return False
+
+        with self.lock:
+            old = self.entries.pop(record.id, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[record.id] = (record, fragment)
+            self.size += len(fragment)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+        return True
+
+    def discard(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def summary(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None,
+                **self.stats
+            }
@@ -0,0 +1,50 @@
+"""
+NayEmail - Ids de mensagem ordenáveis por tempo (estilo ULID)
+26 caracteres em base32 de Crockford: 48 bits de timestamp em milissegundos +
+80 bits aleatórios. A ordem das strings é a ordem de criação (monotônica dentro
+do mesmo milissegundo). Os ids uuid4 antigos continuam válidos
+"""
+
+import os
+import threading
+import time
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+DECODE = {c: i for i, c in enumerate(ALPHABET)}
+ULID_LENGTH = 26
+RANDOM_BITS = 80
+
+_lock = threading.Lock()
+_last = (0, 0)   # (timestamp ms, parte aleatória) do último id gerado
+
+
+def _encode(value):
+    chars = []
+    for _ in range(ULID_LENGTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def new_email_id():
+    """Novo id de mensagem, maior que todos os gerados antes por este processo"""
+    global _last
+    with _lock:
+        now = int(time.time() * 1000)
+        last_ms, last_random = _last
+        if now <= last_ms:
+            # Mesmo milissegundo (ou relógio voltou): incrementa a parte aleatória
+            now, randomness = last_ms, last_random + 1
+            if randomness >> RANDOM_BITS:
+                now, randomness = last_ms + 1, 0
+        else:
+            randomness = int.from_bytes(os.urandom(10), 'big')
+        _last = (now, randomness)
+    return _encode((now << RANDOM_BITS) | randomness)
+
+
+def is_ulid(email_id):
+    """True se o id está no formato novo (ordenável por tempo)"""
+    return (isinstance(email_id, str) and len(email_id) == ULID_LENGTH
+            and email_id[0] <= '7' and all(c in DECODE for c in email_id))
+
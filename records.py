@@ -0,0 +1,316 @@
+"""
+NayEmail - Registro compacto de email
+Substitui o dict de cada email em memória: campos comuns em __slots__, flags
+booleanas num campo de bits e um dict de overflow só para as chaves raras.
+Remetente, destinatário e pasta apontam para a instância única guardada no
+dicionário de endereços (AddressBook), as datas ficam como inteiros
+(microssegundos desde 1970) e o corpo aponta para a entrada deduplicada do
+blobs.BodyPool (em memória ou num arquivo mapeado). Converte sem perdas de
+e para o formato JSON (dict) usado pela API e pelo disco; o JSON já
+serializado pode ficar no fragments.FragmentCache até a próxima alteração
+"""
+
+import sys
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+_MISSING = object()
+
+
+class AddressBook:
+    """Dicionário de endereços e pastas: uma única instância de cada string
+    (sys.intern, a mesma dos literais do código) e um código inteiro pequeno
+    para os índices que preferem chavear por número"""
+
+    def __init__(self):
+        self.codes = {}     # string -> código
+        self.values = []    # código -> string
+        self.lock = threading.Lock()   # só para criar códigos; a leitura não trava
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        """Instância compartilhada da string (outros tipos passam direto)"""
+        if type(value) is not str:
+            return value
+        code = self.codes.get(value)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(value)
+                if code is None:
+                    # values antes de codes: quem lê um código sem lock já encontra a string
+                    value = sys.intern(value)
+                    self.values.append(value)
+                    code = self.codes[value] = len(self.values) - 1
+        return self.values[code]
+
+    def code(self, value, create=True):
+        """Código inteiro da string; -1 para valores que não são string e
+        None para strings desconhecidas com create=False"""
+        if type(value) is not str:
+            return -1
+        code = self.codes.get(value)
+        if code is None and create:
+            self.intern(value)
+            code = self.codes[value]
+        return code
+
+
+# Dicionário compartilhado por todos os registros (e pelo espelho colunar)
+addresses = AddressBook()
+
+# Corpos deduplicados (blobs.BodyPool): com ele o slot 'body' aponta para a
+# entrada compartilhada do pool; None mantém o texto no próprio registro
+body_pool = None
+
+
+def set_body_pool(pool):
+    global body_pool
+    body_pool = pool
+
+# JSON já serializado de cada registro (fragments.FragmentCache); None desativa
+json_cache = None
+
+
+def set_json_cache(cache):
+    global json_cache
+    json_cache = cache
+
+# Campos comuns guardados em slots: chave JSON -> atributo
+SLOT_FIELDS = {
+    'id': 'id',
+    'from': 'sender',
+    'to': 'recipient',
+    'subject': 'subject',
+    'body': 'body',
+    'date': 'date',
+    'folder': 'folder',
+    'site_origin': 'site_origin',
+    'tracking_id': 'tracking_id',
+    'verification_expires': 'verification_expires',
+    'snooze_until': 'snooze_until'
+}
+
+# Campos com poucos valores distintos, guardados pela instância do dicionário de endereços
+INTERNED_FIELDS = {'from', 'to', 'folder'}
+
+# Datas guardadas como inteiro e convertidas para ISO só na leitura (API e disco)
+TIMESTAMP_FIELDS = {'date', 'verification_expires', 'snooze_until'}
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def iso_to_timestamp(value):
+    """ISO sem fuso (de datetime.isoformat()) -> microssegundos desde 1970;
+    None se o inteiro não reproduzir exatamente a mesma string"""
+    if type(value) is not str:
+        return None
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if date.tzinfo is not None or date.isoformat() != value:
+        return None
+    return (date - EPOCH) // MICROSECOND
+
+
+def timestamp_to_iso(timestamp):
+    return (EPOCH + timestamp * MICROSECOND).isoformat()
+
+
+def parse_timestamp(value):
+    """Qualquer data ISO (só a data, com fuso...) -> microssegundos desde 1970; None se inválida"""
+    timestamp = iso_to_timestamp(value)
+    if timestamp is not None or type(value) is not str:
+        return timestamp
+    try:
+        date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return (date - EPOCH) // MICROSECOND
+
+# Flags booleanas no campo de bits: 2 bits por flag (presente, valor).
+# Valores que não são bool (ex.: read=1) vão para o overflow para não perder o tipo
+FLAG_FIELDS = (
+    'read', 'starred', 'highlighted', 'verification', 'password_reset', 'notification',
+    'priority_highlight', 'auto_expire', 'demo_email', 'verification_advanced', 'ai_chat_log'
+)
+FLAG_BITS = {name: 1 << (2 * i) for i, name in enumerate(FLAG_FIELDS)}
+CACHED_BIT = 1 << 31   # o registro tem fragmento no json_cache (descartar ao alterar)
+
+
+class EmailRecord(MutableMapping):
+    """Email em memória com a mesma interface de dict (get, [], in, items, update...)"""
+
+    __slots__ = tuple(SLOT_FIELDS.values()) + ('_flags', '_extra')
+
+    def __init__(self, data=()):
+        for attr in SLOT_FIELDS.values():
+            setattr(self, attr, _MISSING)
+        self._flags = 0
+        self._extra = None
+        for key, value in dict(data).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        attr = SLOT_FIELDS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not _MISSING:
+                if key in TIMESTAMP_FIELDS:
+                    return timestamp_to_iso(value)
+                if key == 'body' and body_pool is not None:
+                    return body_pool.read(value)
+                return value
+        else:
+            bit = FLAG_BITS.get(key)
+            if bit is not None and self._flags & bit:
+                return bool(self._flags & (bit << 1))
+
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        attr = SLOT_FIELDS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not _MISSING:
+                if key in TIMESTAMP_FIELDS:
+                    return timestamp_to_iso(value)
+                if key == 'body' and body_pool is not None:
+                    return body_pool.read(value)
+                return value
+            if self._extra is None:
+                return default
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if self._flags & CACHED_BIT:
+            self._uncache()
+        attr = SLOT_FIELDS.get(key)
+        if attr is not None:
+            if key in INTERNED_FIELDS:
+                value = addresses.intern(value)
+            elif key in TIMESTAMP_FIELDS:
+                timestamp = iso_to_timestamp(value)
+                if timestamp is None:
+                    # Formato que não volta idêntico do inteiro: guarda como veio
+                    setattr(self, attr, _MISSING)
+                    self._set_extra(key, value)
+                    return
+                value = timestamp
+            elif key == 'body' and body_pool is not None:
+                self.release()
+                if type(value) is not str:
+                    self._set_extra(key, value)
+                    return
+                value = body_pool.acquire(value)
+            setattr(self, attr, value)
+            if self._extra:
+                self._pop_extra(key)
+            return
+
+        bit = FLAG_BITS.get(key)
+        if bit is not None:
+            self._flags &= ~(bit | bit << 1)
+            if type(value) is bool:
+                self._flags |= bit | (bit << 1 if value else 0)
+                if self._extra:
+                    self._pop_extra(key)
+                return
+
+        self._set_extra(key, value)
+
+    def _set_extra(self, key, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def _pop_extra(self, key):
+        self._extra.pop(key, None)
+        if not self._extra:
+            self._extra = None
+
+    def __delitem__(self, key):
+        if self._flags & CACHED_BIT:
+            self._uncache()
+        attr = SLOT_FIELDS.get(key)
+        if attr is not None:
+            if getattr(self, attr) is not _MISSING:
+                if key == 'body' and body_pool is not None:
+                    self.release()
+                else:
+                    setattr(self, attr, _MISSING)
+                return
+        else:
+            bit = FLAG_BITS.get(key)
+            if bit is not None and self._flags & bit:
+                self._flags &= ~(bit | bit << 1)
+                return
+
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        self._pop_extra(key)
+
+    def __iter__(self):
+        for key, attr in SLOT_FIELDS.items():
+            if getattr(self, attr) is not _MISSING:
+                yield key
+        for key, bit in FLAG_BITS.items():
+            if self._flags & bit:
+                yield key
+        if self._extra:
+            yield from list(self._extra)
+
+    def release(self):
+        """Devolve ao pool a referência do corpo (email excluído ou corpo trocado)"""
+        if self._flags & CACHED_BIT:
+            self._uncache()
+        if body_pool is not None and self.body is not _MISSING:
+            body_pool.release(self.body)
+            self.body = _MISSING
+
+    def _uncache(self):
+        self._flags &= ~CACHED_BIT
+        if json_cache is not None:
+            json_cache.discard(self.id)
+
+    def json_fragment(self, encode):
+        """JSON do email em bytes (encode(dict) -> bytes), reaproveitado do
+        json_cache enquanto o registro não muda"""
+        if json_cache is None or type(self.id) is not str:
+            return encode(self.to_dict())
+
+        fragment = json_cache.get(self)
+        if fragment is None:
+            fragment = encode(self.to_dict())
+            if json_cache.put(self, fragment):
+                self._flags |= CACHED_BIT
+        return fragment
+
+    def timestamp(self, key='date'):
+        """Campo de data como inteiro (microssegundos desde 1970, sem fuso);
+        None se ausente ou guardado em outro formato"""
+        value = getattr(self, SLOT_FIELDS[key])
+        return None if value is _MISSING else value
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """Formato JSON original do email"""
+        return dict(self)
+
+    def copy(self):
+        return self.to_dict()
+
+    def __repr__(self):
+        return f"EmailRecord({self.to_dict()!r})"
@@ -108,6 +108,12 @@ let userInfo = null;
 let searchTimeout = null;
 let emails_db = []; // Initialize emails_db
 
+// Paginação das listagens
+const EMAILS_PAGE_SIZE = 50;
+let loadedEmails = [];
+let nextEmailsCursor = null;
+let currentSearchQuery = null;
+
 // Inicializar aplicação
 document.addEventListener('DOMContentLoaded', function() {
     initializeApp();
@@ -127,6 +133,7 @@ async function initializeApp() {
         if (userInfo) {
             await loadEmails();
             setupEventListeners();
+            startMailboxEvents();
             initializeAdsSystem(); // Inicializar sistema de anúncios
             showNotification('NayEmail carregado com sucesso!', 'success');
         } else {
@@ -250,17 +257,24 @@ async function loadEmails() {
         showLoading();
         let response;
 
+        currentSearchQuery = null;
+
         if (currentFolder === 'highlighted') {
             response = await fetch('/api/admin/highlighted-emails');
         } else {
-            response = await fetch(`/api/emails/${currentFolder}`);
+            response = await fetch(`/api/emails/${currentFolder}?limit=${EMAILS_PAGE_SIZE}`);
         }
 
         if (response.ok) {
-            const emails = await response.json();
+            const data = await response.json();
+
+            // Pastas respondem com página ({emails, next_cursor}); destacados com array
+            const emails = Array.isArray(data) ? data : data.emails;
+            nextEmailsCursor = Array.isArray(data) ? null : data.next_cursor;
 
             // Garantir que emails é um array
             if (Array.isArray(emails)) {
+                loadedEmails = emails;
                 displayEmails(emails);
             } else {
                 console.error('Resposta não é um array:', emails);
@@ -277,6 +291,36 @@ async function loadEmails() {
     }
 }
 
+async function loadMoreEmails() {
+    if (!nextEmailsCursor) return;
+
+    try {
+        let response;
+        const cursor = nextEmailsCursor;
+
+        if (currentSearchQuery) {
+            response = await fetch('/api/search', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ query: currentSearchQuery, limit: EMAILS_PAGE_SIZE, cursor })
+            });
+        } else {
+            response = await fetch(`/api/emails/${currentFolder}?limit=${EMAILS_PAGE_SIZE}&cursor=${encodeURIComponent(cursor)}`);
+        }
+
+        if (response.ok) {
+            const data = await response.json();
+            loadedEmails = loadedEmails.concat(data.emails || []);
+            nextEmailsCursor = data.next_cursor;
+            displayEmails(loadedEmails);
+        }
+    } catch (error) {
+        console.error('Erro ao carregar mais emails:', error);
+    }
+}
+
 function displayEmails(emails) {
     const container = document.getElementById('emailsContainer');
 
@@ -309,6 +353,14 @@ function displayEmails(emails) {
         return adHTML + getEmailHTML(email);
     }).join('');
 
+    if (nextEmailsCursor) {
+        emailsHTML += `
+            <div class="load-more-emails">
+                <button onclick="loadMoreEmails()">Carregar mais emails</button>
+            </div>
+        `;
+    }
+
     container.innerHTML = emailsHTML;
 
     // Carregar anúncios do Google após inserir HTML
@@ -685,13 +737,62 @@ async function checkTokenRequests() {
     }
 }
 
-// Verificar solicitações de token a cada 30 segundos (apenas para admin)
+// Verificar solicitações de token a cada 30 segundos (apenas para admin),
+// só enquanto os eventos ao vivo não estão conectados
 setInterval(() => {
-    if (userInfo && userInfo.is_admin) {
+    if (userInfo && userInfo.is_admin && !mailboxEventsConnected) {
         checkTokenRequests();
     }
 }, 30000);
 
+// Eventos ao vivo da caixa postal (/api/events): recarrega só quando algo mudou
+let mailboxEvents = null;
+let mailboxEventsConnected = false;
+let mailboxRefreshTimeout = null;
+
+function startMailboxEvents() {
+    if (!window.EventSource || mailboxEvents) return;
+
+    mailboxEvents = new EventSource('/api/events');
+    mailboxEvents.onopen = () => { mailboxEventsConnected = true; };
+    mailboxEvents.onerror = () => { mailboxEventsConnected = false; }; // o navegador reconecta sozinho
+
+    mailboxEvents.addEventListener('new-mail', (e) => {
+        const data = JSON.parse(e.data);
+        if (userInfo && userInfo.is_admin && (data.subject || '').toLowerCase().includes('token')) {
+            checkTokenRequests();
+        }
+        scheduleMailboxRefresh();
+    });
+    ['flag-change', 'deleted', 'verification-expired', 'resync'].forEach(name => {
+        mailboxEvents.addEventListener(name, scheduleMailboxRefresh);
+    });
+}
+
+// Junta rajadas de eventos numa única recarga
+function scheduleMailboxRefresh() {
+    clearTimeout(mailboxRefreshTimeout);
+    mailboxRefreshTimeout = setTimeout(async () => {
+        await refreshUserCounts();
+        // Não recarregar a lista durante uma busca ou com um email aberto
+        if (!currentSearchQuery && !currentEmail) {
+            loadEmails();
+        }
+    }, 500);
+}
+
+async function refreshUserCounts() {
+    try {
+        const response = await fetch('/api/user-info');
+        if (response.ok) {
+            userInfo = await response.json();
+            updateCounts();
+        }
+    } catch (error) {
+        console.error('Erro ao atualizar contadores:', error);
+    }
+}
+
 function showCompose() {
     document.getElementById('composeModal').classList.add('active');
     document.getElementById('composeTo').focus();
@@ -895,12 +996,15 @@ async function handleSearch(e) {
                     headers: {
                         'Content-Type': 'application/json'
                     },
-                    body: JSON.stringify({ query })
+                    body: JSON.stringify({ query, limit: EMAILS_PAGE_SIZE })
                 });
 
                 if (response.ok) {
-                    const results = await response.json();
-                    displayEmails(results);
+                    const data = await response.json();
+                    currentSearchQuery = query;
+                    loadedEmails = data.emails;
+                    nextEmailsCursor = data.next_cursor;
+                    displayEmails(loadedEmails);
                 }
             } catch (error) {
                 console.error('Erro na busca:', error);
@@ -1538,7 +1642,7 @@ function startVerificationAutoRefresh() {
         const hasVerificationEmails = currentEmailsContainer && 
             currentEmailsContainer.innerHTML.includes('verification-status-indicator');
 
-        if (hasVerificationEmails) {
+        if (hasVerificationEmails && !mailboxEventsConnected) {
             // Recarregar emails silenciosamente para atualizar status de expiração
             loadEmails();
         }
@@ -3074,7 +3178,7 @@ function startVerificationAutoRefresh() {
         const hasVerificationEmails = currentEmailsContainer &&
             currentEmailsContainer.innerHTML.includes('verification-status-indicator');
 
-        if (hasVerificationEmails) {
+        if (hasVerificationEmails && !mailboxEventsConnected) {
             // Recarregar emails silenciosamente para atualizar status de expiração
             loadEmails();
         }
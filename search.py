@@ -0,0 +1,264 @@
+"""
+NayEmail - Índices de busca
+Índice invertido (palavras), índice de trigramas (substring) e índice de
+marcadores (operadores from:, is:, category: ...) por usuário para /api/search
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+# Campos pesquisados (os mesmos da busca original)
+SEARCH_FIELDS = ('subject', 'body', 'from')
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Operadores da busca estruturada: nome:valor ou nome:"valor com espaços"
+OPERATOR_RE = re.compile(r'(?<!\S)(from|to|subject|is|category|has|site|before|after):("[^"]*"|\S+)', re.IGNORECASE)
+
+# has:<nome> -> campo booleano do email
+HAS_FLAGS = {
+    'verification': 'verification',
+    'reset': 'password_reset',
+    'notification': 'notification'
+}
+
+# Operadores que comparam palavras por prefixo (os demais são exatos)
+PREFIX_OPERATORS = {'from', 'to', 'subject', 'site'}
+
+
+def fold_text(text):
+    """Minúsculas e sem acentos ("Verificação" -> "verificacao")"""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Quebra o texto em palavras normalizadas"""
+    return TOKEN_RE.findall(fold_text(text))
+
+
+def email_tokens(email):
+    """Conjunto de palavras dos campos pesquisáveis do email"""
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        value = email.get(field)
+        if value:
+            tokens.update(tokenize(value))
+    return tokens
+
+
+def email_tags(email):
+    """Marcadores do email para os operadores da busca estruturada"""
+    tags = set()
+
+    for field, name in (('from', 'from'), ('to', 'to'), ('subject', 'subject'), ('site_origin', 'site')):
+        value = email.get(field)
+        if value:
+            tags.update(f"{name}:{token}" for token in tokenize(value))
+
+    tags.add('is:read' if email.get('read') else 'is:unread')
+    if email.get('starred'):
+        tags.add('is:starred')
+    if email.get('highlighted'):
+        tags.add('is:highlighted')
+    if email.get('category'):
+        tags.add(f"category:{fold_text(email['category'])}")
+    for flag, field in HAS_FLAGS.items():
+        if email.get(field):
+            tags.add(f"has:{flag}")
+
+    return tags
+
+
+TAG_FIELDS = {'from', 'to', 'subject', 'site_origin', 'read', 'starred', 'highlighted', 'category'} | set(HAS_FLAGS.values())
+
+
+def parse_search_query(query):
+    """Separa os operadores (nome, valor) do texto livre da consulta"""
+    filters = [(m.group(1).lower(), m.group(2).strip('"')) for m in OPERATOR_RE.finditer(query)]
+    if not filters:
+        # Sem operadores a consulta segue intacta (espaços contam na busca por substring)
+        return [], query
+    return filters, OPERATOR_RE.sub(' ', query).strip()
+
+
+def email_owners(email):
+    """Endereços que podem encontrar o email na busca (remetente e destinatário)"""
+    return {address for address in (email.get('to'), email.get('from')) if isinstance(address, str)}
+
+
+class InvertedIndex:
+    """Índice invertido por usuário: palavra -> ids dos emails, com vocabulário
+    ordenado para busca por prefixo. Com terms=email_tags vira o índice de marcadores"""
+
+    def __init__(self, terms=email_tokens, fields=SEARCH_FIELDS):
+        self.terms = terms
+        self.fields = set(fields) | {'from', 'to'}   # campos que exigem reindexar o email
+        self.postings = {}   # usuário -> {palavra: set(ids)}
+        self.vocab = {}      # usuário -> lista ordenada de palavras (None = reordenar na próxima busca)
+
+    def clear(self):
+        self.postings.clear()
+        self.vocab.clear()
+
+    def add(self, email):
+        """Indexa um email para o remetente e o destinatário"""
+        email_id = email.get('id')
+        tokens = self.terms(email)
+
+        for owner in email_owners(email):
+            user_postings = self.postings.setdefault(owner, {})
+            vocab = self.vocab.get(owner)
+            for token in tokens:
+                ids = user_postings.get(token)
+                if ids is None:
+                    ids = user_postings[token] = set()
+                    if vocab is not None:
+                        insort(vocab, token)
+                ids.add(email_id)
+
+    def add_many(self, emails):
+        """Indexa emails em lote (o vocabulário é reordenado uma vez, na próxima busca)"""
+        for email in emails:
+            for owner in email_owners(email):
+                self.vocab[owner] = None
+            self.add(email)
+
+    def remove(self, email):
+        """Remove um email do índice"""
+        email_id = email.get('id')
+        tokens = self.terms(email)
+
+        for owner in email_owners(email):
+            user_postings = self.postings.get(owner, {})
+            vocab = self.vocab.get(owner)
+            for token in tokens:
+                ids = user_postings.get(token)
+                if ids is None:
+                    continue
+                ids.discard(email_id)
+                if not ids:
+                    del user_postings[token]
+                    if vocab is not None:
+                        i = bisect_left(vocab, token)
+                        if i < len(vocab) and vocab[i] == token:
+                            del vocab[i]
+
+    def _vocabulary(self, user_email):
+        vocab = self.vocab.get(user_email)
+        if vocab is None:
+            vocab = self.vocab[user_email] = sorted(self.postings.get(user_email, {}))
+        return vocab
+
+    def term_ids(self, user_email, term):
+        """Ids dos emails do usuário com o termo exato"""
+        return set(self.postings.get(user_email, {}).get(term, ()))
+
+    def prefix_ids(self, user_email, prefix):
+        """Ids dos emails do usuário com alguma palavra começando pelo prefixo"""
+        user_postings = self.postings.get(user_email, {})
+        vocab = self._vocabulary(user_email)
+
+        ids = set()
+        i = bisect_left(vocab, prefix)
+        while i < len(vocab) and vocab[i].startswith(prefix):
+            ids.update(user_postings[vocab[i]])
+            i += 1
+        return ids
+
+    def search(self, user_email, query):
+        """Ids dos emails que contêm todos os termos (por prefixo); None se a
+        consulta não tem palavras indexáveis"""
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not terms:
+            return None
+
+        result = None
+        for term in terms:
+            ids = self.prefix_ids(user_email, term)
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result
+
+
+def trigrams(text):
+    """Trigramas (substrings de 3 caracteres) de um texto"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def email_trigrams(email):
+    """Trigramas dos campos pesquisáveis (em minúsculas, como a busca original)"""
+    grams = set()
+    for field in SEARCH_FIELDS:
+        value = email.get(field)
+        if value:
+            grams.update(trigrams(str(value).lower()))
+    return grams
+
+
+def email_contains(email, query):
+    """Verificação exata da busca original: query contida em subject, body ou from"""
+    return any(query in str(email.get(field) or '').lower() for field in SEARCH_FIELDS)
+
+
+class TrigramIndex:
+    """Índice de trigramas por usuário: reduz os candidatos de uma busca por
+    substring antes da verificação exata com `query in texto`"""
+
+    fields = set(SEARCH_FIELDS) | {'from', 'to'}
+
+    def __init__(self):
+        self.postings = {}   # usuário -> {trigrama: set(ids)}
+
+    def clear(self):
+        self.postings.clear()
+
+    def add(self, email):
+        email_id = email.get('id')
+        grams = email_trigrams(email)
+
+        for owner in email_owners(email):
+            user_postings = self.postings.setdefault(owner, {})
+            for gram in grams:
+                ids = user_postings.get(gram)
+                if ids is None:
+                    ids = user_postings[gram] = set()
+                ids.add(email_id)
+
+    def add_many(self, emails):
+        for email in emails:
+            self.add(email)
+
+    def remove(self, email):
+        email_id = email.get('id')
+        grams = email_trigrams(email)
+
+        for owner in email_owners(email):
+            user_postings = self.postings.get(owner, {})
+            for gram in grams:
+                ids = user_postings.get(gram)
+                if ids is None:
+                    continue
+                ids.discard(email_id)
+                if not ids:
+                    del user_postings[gram]
+
+    def candidates(self, user_email, query):
+        """Ids que contêm todos os trigramas da consulta; None se a consulta
+        tem menos de 3 caracteres (não dá para filtrar)"""
+        grams = trigrams(query)
+        if not grams:
+            return None
+
+        user_postings = self.postings.get(user_email, {})
+        result = None
+        for gram in sorted(grams, key=lambda g: len(user_postings.get(g, ()))):
+            ids = user_postings.get(gram)
+            if not ids:
+                return set()
+            result = set(ids) if result is None else result & ids
+            if not result:
+                break
+        return result
@@ -1,14 +1,42 @@
-from flask import Flask, request, jsonify, send_from_directory, session, redirect
+from flask import Flask, Response, request, jsonify, send_from_directory, session, redirect
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import json
 import os
 from datetime import datetime, timedelta
 import threading
 import time
+import atexit
 import hashlib
 import uuid
+import base64
+import heapq
+from bisect import bisect_left, insort
+from itertools import islice
+
+from storage import JsonStorage, JournalStorage, SQLiteStorage, ShardedStorage
+from records import EmailRecord, addresses, parse_timestamp, set_body_pool, set_json_cache, timestamp_to_iso
+from blobs import BlobStore, BodyPool
+from fragments import FragmentCache
+from ids import new_email_id, is_ulid
+from events import EventHub, format_event
+from sync import ChangeLog
+import columnar
+from columnar import ColumnStore, COLUMN_FIELDS, FLAG_HIGHLIGHTED, FLAG_LOG
+from search import (InvertedIndex, TrigramIndex, TAG_FIELDS, PREFIX_OPERATORS, email_contains,
+                    email_tags, email_tokens, fold_text, parse_search_query, tokenize)
+
+class NayEmailJSONProvider(DefaultJSONProvider):
+    """jsonify que entende o registro compacto de email"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, EmailRecord):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = NayEmailJSONProvider(app)
 # Configurar CORS para produção (incluindo subdomínios)
 CORS(app, supports_credentials=True, origins=["*"], allow_headers=["*"], methods=["*"])
 app.secret_key = 'gmail-system-secret-key-2024'
@@ -16,6 +44,9 @@ app.secret_key = 'gmail-system-secret-key-2024'
 # Configurações do sistema
 USERS_FILE = 'users.json'
 EMAILS_FILE = 'emails.json'
+JOURNAL_FILE = 'emails.journal'
+SQLITE_FILE = 'nayemail.db'
+MAILBOXES_DIR = 'mailboxes'
 ADMIN_EMAIL = 'admin@nayemail.com'
 
 # Sistema de domínios personalizados
@@ -48,37 +79,807 @@ FEATURES = {
     'attachments': True,
     'themes': True
 }
+
+# Temas da interface
+THEMES = {
+    'default': {
+        'name': 'NayEmail Padrão',
+        'primary_color': '#6c63ff',
+        'secondary_color': '#4caf50',
+        'background': '#ffffff',
+        'text_color': '#333333'
+    },
+    'dark': {
+        'name': 'Modo Escuro',
+        'primary_color': '#bb86fc',
+        'secondary_color': '#03dac6',
+        'background': '#121212',
+        'text_color': '#ffffff'
+    },
+    'blue': {
+        'name': 'Azul Profissional',
+        'primary_color': '#1976d2',
+        'secondary_color': '#2196f3',
+        'background': '#f5f5f5',
+        'text_color': '#333333'
+    },
+    'green': {
+        'name': 'Verde Natureza',
+        'primary_color': '#388e3c',
+        'secondary_color': '#4caf50',
+        'background': '#e8f5e8',
+        'text_color': '#2e7d32'
+    }
+}
+
 registered_companies = {}  # Empresas registradas com subdomínios
 
+# Persistência: 'json' regrava os arquivos inteiros a cada alteração,
+# 'journal' grava só o registro da alteração e compacta em segundo plano,
+# 'sqlite' grava as linhas alteradas no banco (migrar com: python storage.py import-sqlite),
+# 'sharded' grava um arquivo por conversa (remetente/destinatário) e só os shards alterados
+STORAGE_BACKEND = os.environ.get('NAYEMAIL_STORAGE', 'json')
+# 'sharded' e 'sqlite': cada caixa postal é carregada no primeiro acesso
+SHARD_LAZY_LOAD = os.environ.get('NAYEMAIL_SHARD_LAZY_LOAD', '1') == '1'
+JOURNAL_COMPACT_INTERVAL = int(os.environ.get('NAYEMAIL_JOURNAL_COMPACT_INTERVAL', 60))  # segundos
+JOURNAL_COMPACT_BYTES = int(os.environ.get('NAYEMAIL_JOURNAL_COMPACT_BYTES', 4 * 1024 * 1024))
+TOMBSTONE_COMPACT_MIN = 1000  # exclusões acumuladas antes de compactar emails_db
+# Write-behind: metadados de baixo valor (último login, lido) ficam em memória por
+# até N segundos antes de gravar; 0 grava na hora como antes
+WRITE_BEHIND_SECONDS = float(os.environ.get('NAYEMAIL_WRITE_BEHIND', 5))
+# Group commit: save_data() espera o group_committer, que junta as gravações que
+# chegam em até N milissegundos num único commit, durável ao retornar (fsync no
+# journal e nos JSON, synchronous=FULL no SQLite); 0 grava na própria requisição
+GROUP_COMMIT_MS = float(os.environ.get('NAYEMAIL_GROUP_COMMIT_MS', 0))
+# Threads de fundo só no processo que atende as requisições: com `python server.py`
+# (debug) o reloader do Werkzeug importa o módulo também no processo pai, que só
+# vigia os arquivos e ficaria com uma cópia velha dos dados
+# (lá as gravações são feitas na hora, sem write-behind nem group commit)
+SERVING_PROCESS = __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+# Busca: 'words' usa o índice invertido (palavras, sem acento, por prefixo);
+# 'substring' usa o índice de trigramas e mantém a semântica exata de `query in texto`
+SEARCH_MODE = os.environ.get('NAYEMAIL_SEARCH', 'words')
+
+# Corpos dos emails, deduplicados por conteúdo: 'memory' guarda o texto em memória;
+# 'mmap' guarda num arquivo temporário append-only lido via mmap (cache do processo:
+# o storage continua gravando o corpo com o email)
+BODY_STORE = os.environ.get('NAYEMAIL_BODY_STORE', 'memory')
+
+# Cache do JSON já serializado de cada email para as listagens, em MB; 0 desativa
+JSON_CACHE_MB = float(os.environ.get('NAYEMAIL_JSON_CACHE_MB', 64))
+
+# Espelho colunar (NumPy, opcional) para os filtros das visões administrativas
+COLUMNAR_ENABLED = os.environ.get('NAYEMAIL_COLUMNAR', '1') == '1' and columnar.available
+
+# Eventos ao vivo (/api/events): intervalo dos comentários de keep-alive, em segundos
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('NAYEMAIL_EVENTS_HEARTBEAT', 25))
+
+# Sincronização incremental (/api/sync): alterações guardadas por caixa postal
+SYNC_LOG_MAX = int(os.environ.get('NAYEMAIL_SYNC_LOG_MAX', 10000))
+
+# Paginação das listagens (/api/emails/<folder> e /api/search)
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+def create_storage():
+    """Cria o backend de persistência configurado"""
+    if STORAGE_BACKEND == 'journal':
+        return JournalStorage(USERS_FILE, EMAILS_FILE, JOURNAL_FILE, JOURNAL_COMPACT_BYTES)
+    if STORAGE_BACKEND == 'sqlite':
+        return SQLiteStorage(SQLITE_FILE, lazy=SHARD_LAZY_LOAD, durable=GROUP_COMMIT_MS > 0)
+    if STORAGE_BACKEND == 'sharded':
+        return ShardedStorage(USERS_FILE, EMAILS_FILE, MAILBOXES_DIR, lazy=SHARD_LAZY_LOAD)
+    return JsonStorage(USERS_FILE, EMAILS_FILE)
+
+storage = create_storage()
+storage.email_type = EmailRecord  # emails em memória no registro compacto (records.py)
+body_pool = BodyPool(BlobStore() if BODY_STORE == 'mmap' else None)
+set_body_pool(body_pool)
+json_cache = FragmentCache(int(JSON_CACHE_MB * 1024 * 1024)) if JSON_CACHE_MB > 0 else None
+set_json_cache(json_cache)
+data_lock = threading.RLock()
+
 # Armazenamento em memória
 users_db = {}
-emails_db = []
+emails_db = []          # emails excluídos viram None (tombstone) até a compactação
+email_positions = {}    # índice primário: id do email -> posição em emails_db
+folder_index = {}       # índice por usuário e pasta: email -> pasta -> [(data, id)] em ordem de data
+unread_counts = {}      # contador de não lidos na caixa de entrada: email -> quantidade
+search_index = InvertedIndex()  # índice invertido da busca, por usuário
+tag_index = InvertedIndex(terms=email_tags, fields=TAG_FIELDS)  # operadores from:, is:, category: ...
+trigram_index = TrigramIndex() if SEARCH_MODE == 'substring' else None
+text_indexes = [index for index in (search_index, tag_index, trigram_index) if index is not None]
+email_columns = ColumnStore() if COLUMNAR_ENABLED else None  # metadados por posição de emails_db
+announcements = {}  # id -> comunicado do admin (um registro só, entregue a cada caixa na leitura)
+event_hub = EventHub()  # conexões de /api/events por usuário
+expiry_queue = []       # heap de (verification_expires em µs, id) para os eventos de expiração
+expiry_cond = threading.Condition()
+change_log = ChangeLog(SYNC_LOG_MAX)  # sequência de alterações por caixa postal (/api/sync)
+ANNOUNCEMENT_MAILBOX = '*'            # caixa do log onde ficam os comunicados
+USERS_VERSION = 'users'               # chave de versão do cadastro de usuários (ETags)
+tombstones = 0
+
+# Campos que definem em quais pastas um email aparece / se conta como não lido
+FOLDER_FIELDS = {'from', 'to', 'folder', 'starred', 'date'}
+OWNER_FIELDS = {'from', 'to', 'audience'}  # caixas postais do email (log de sincronização)
+UNREAD_FIELDS = {'to', 'read'}
+
 current_session = {}
 
+# Controle de alterações: save_data() só grava quando algo mudou de fato
+pending_changes = 0
+persistence_stats = {
+    'writes': 0,               # commits que gravaram alterações
+    'writes_avoided': 0,       # chamadas a save_data() sem nada para gravar
+    'unchanged_updates': 0,    # atualizações ignoradas porque os valores já eram iguais
+    'deferred': 0,             # gravações adiadas pelo write-behind
+    'group_commits': 0,        # commits feitos pelo group_committer
+    'grouped_requests': 0      # pedidos de gravação atendidos por esses commits
+}
+deferred_since = None  # momento (monotonic) da alteração adiada mais antiga
+
+# Lote aberto do group commit: pedidos esperam 'done' com commit_cond
+commit_cond = threading.Condition()
+commit_batch = {'requests': 0, 'done': False, 'error': None}
+MISSING = object()
+
 def load_data():
-    """Carrega dados dos arquivos JSON"""
+    """Carrega dados do backend de persistência"""
     global users_db, emails_db
 
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            users_db = json.load(f)
+    with data_lock:
+        body_pool.clear()
+        if json_cache is not None:
+            json_cache.clear()
+        users_db, emails_db = storage.load()
+        rebuild_email_index()
+        change_log.reset()
+
+def rebuild_email_index():
+    """Reconstrói os índices de emails"""
+    global tombstones
+    email_positions.clear()
+    folder_index.clear()
+    unread_counts.clear()
+    for index in text_indexes:
+        index.clear()
+    if email_columns is not None:
+        email_columns.clear()
+    announcements.clear()
+    with expiry_cond:
+        expiry_queue.clear()  # index_emails agenda de novo as verificações pendentes
+    tombstones = 0
+    index_emails(0)
+
+def index_emails(start):
+    """Indexa os emails adicionados a partir de uma posição de emails_db"""
+    touched = []
+    for index in text_indexes:
+        index.add_many(e for e in emails_db[start:] if isinstance(e, EmailRecord))
+    if email_columns is not None:
+        email_columns.set_rows(start, [e if isinstance(e, EmailRecord) else None for e in emails_db[start:]])
+    for position in range(start, len(emails_db)):
+        email = emails_db[position]
+        if isinstance(email, EmailRecord):
+            email_positions[email.get('id')] = position
+            if email.get('audience'):
+                announcements[email.get('id')] = email
+            schedule_expiry(email)
+            count_unread(email, 1)
+            for user_email, folder in email_folders(email):
+                postings = folder_index.setdefault(user_email, {}).setdefault(folder, [])
+                postings.append(folder_posting(email))
+                touched.append(postings)
+
+    # Carga em lote: ordenar uma vez cada lista tocada em vez de inserir ordenado
+    for postings in {id(p): p for p in touched}.values():
+        postings.sort()
+
+def compact_emails():
+    """Remove os tombstones de emails_db e reconstrói o índice primário"""
+    global tombstones
+    with data_lock:
+        emails_db[:] = [e for e in emails_db if e is not None]
+        email_positions.clear()
+        for position, email in enumerate(emails_db):
+            email_positions[email.get('id')] = position
+        if email_columns is not None:
+            email_columns.clear()
+            email_columns.set_rows(0, [e if isinstance(e, EmailRecord) else None for e in emails_db])
+        if body_pool.dead_bytes:
+            body_pool.compact()
+        tombstones = 0
+
+def email_folders(email):
+    """Lista os pares (usuário, pasta) em que o email aparece"""
+    sender = email.get('from')
+    recipient = email.get('to')
+    entries = set()
+
+    if isinstance(recipient, str):
+        entries.add((recipient, 'inbox'))
+    if isinstance(sender, str):
+        entries.add((sender, 'sent'))
+        if email.get('folder') == 'drafts':
+            entries.add((sender, 'drafts'))
+    if email.get('starred'):
+        for address in (recipient, sender):
+            if isinstance(address, str):
+                entries.add((address, 'starred'))
+
+    return entries
+
+def folder_posting(email):
+    """Chave do email nos índices de pasta (ordenada por data)"""
+    return (date_key(email), str(email.get('id') or ''))
+
+def date_key(email):
+    """Data do email como inteiro (microssegundos desde 1970); -1 se ausente ou inválida"""
+    timestamp = email.timestamp() if isinstance(email, EmailRecord) else None
+    if timestamp is None:
+        timestamp = parse_timestamp(email.get('date'))
+    return -1 if timestamp is None else timestamp
+
+def folder_range(postings, after=None, before=None):
+    """Fatia [início, fim) das postings com data em [after, before)"""
+    start = bisect_left(postings, (after, '')) if after is not None else 0
+    end = bisect_left(postings, (before, '')) if before is not None else len(postings)
+    return start, max(start, end)
+
+def index_email_folders(email):
+    """Insere o email, em ordem de data, nos índices de pasta"""
+    for user_email, folder in email_folders(email):
+        insort(folder_index.setdefault(user_email, {}).setdefault(folder, []), folder_posting(email))
+
+def unindex_email_folders(email):
+    """Remove o email dos índices de pasta"""
+    key = folder_posting(email)
+    for user_email, folder in email_folders(email):
+        postings = folder_index.get(user_email, {}).get(folder)
+        if not postings:
+            continue
+        i = bisect_left(postings, key)
+        if i < len(postings) and postings[i] == key:
+            del postings[i]
+
+def count_unread(email, delta):
+    """Atualiza o contador de não lidos do destinatário"""
+    recipient = email.get('to')
+    if isinstance(recipient, str) and not email.get('read'):
+        unread_counts[recipient] = unread_counts.get(recipient, 0) + delta
+
+def get_mailbox_counts(user_email):
+    """Contadores da caixa do usuário, lidos dos índices em O(1)"""
+    ensure_mailbox(user_email)
+    folders = folder_index.get(user_email, {})
+    return {
+        'inbox_count': unread_counts.get(user_email, 0) + count_unread_announcements(user_email),
+        'sent_count': len(folders.get('sent', [])),
+        'drafts_count': len(folders.get('drafts', []))
+    }
+
+def check_mailbox_counts():
+    """Recalcula os contadores varrendo os emails e lista as divergências"""
+    expected = {}
+    for email in iter_emails():
+        recipient = email.get('to')
+        sender = email.get('from')
+        if isinstance(recipient, str) and not email.get('read'):
+            expected.setdefault(recipient, {'inbox_count': 0, 'sent_count': 0, 'drafts_count': 0})['inbox_count'] += 1
+        if isinstance(sender, str):
+            counts = expected.setdefault(sender, {'inbox_count': 0, 'sent_count': 0, 'drafts_count': 0})
+            counts['sent_count'] += 1
+            if email.get('folder') == 'drafts':
+                counts['drafts_count'] += 1
+
+    # Comunicados não lidos entram na caixa de entrada de cada destinatário, como nos contadores
+    if announcements:
+        for user_email in users_db:
+            unread = count_unread_announcements(user_email)
+            if unread:
+                expected.setdefault(user_email, {'inbox_count': 0, 'sent_count': 0, 'drafts_count': 0})['inbox_count'] += unread
+
+    mismatches = []
+    for user_email in set(expected) | set(folder_index) | set(unread_counts):
+        actual = get_mailbox_counts(user_email)
+        wanted = expected.get(user_email, {'inbox_count': 0, 'sent_count': 0, 'drafts_count': 0})
+        if actual != wanted:
+            mismatches.append({'email': user_email, 'counters': actual, 'expected': wanted})
+
+    return mismatches
+
+def iter_folder(user_email, folder, after=None, before=None):
+    """Percorre os emails de uma pasta do usuário, do mais recente ao mais antigo
+    (opcionalmente só os com data em [after, before))"""
+    postings = folder_index.get(user_email, {}).get(folder, [])
+    start, end = folder_range(postings, after, before)
+    entries = ((posting, None) for posting in reversed(postings[start:end]))
+
+    extra = announcement_postings(user_email, folder, after, before)
+    if extra:
+        entries = heapq.merge(entries, extra, key=lambda entry: entry[0], reverse=True)
+
+    for posting, view in entries:
+        email = view if view is not None else find_email(posting[1])
+        if email is not None:
+            yield email
+
+def select_columns(mask):
+    """Emails das linhas que passam na máscara colunar, do mais recente ao mais antigo"""
+    with data_lock:
+        return [emails_db[position] for position in email_columns.newest_first(email_columns.mask() & mask)]
+
+def iter_emails():
+    """Percorre os emails ativos (ignora tombstones)"""
+    for email in emails_db:
+        if isinstance(email, EmailRecord):
+            yield email
+
+def find_email(email_id, user_email=None):
+    """Busca um email pelo id; com user_email, só se pertencer ao usuário
+    (comunicados voltam como a cópia do usuário, ver announcement_view)"""
+    with data_lock:  # compact_emails reescreve emails_db e email_positions
+        position = email_positions.get(email_id)
+        if position is None:
+            return None
+
+        email = emails_db[position]
+        if user_email is not None and email.get('to') != user_email and email.get('from') != user_email:
+            if email_id in announcements and announcement_visible(email, user_email):
+                return announcement_view(email, user_email)
+            return None
+        return email
+
+# Comunicados (broadcast): um registro com audience, mesclado na caixa de entrada
+# de cada usuário na leitura. O estado por usuário (lido, favorito, excluído...)
+# fica em users_db[usuário]['announcements'][id]
+def announcement_visible(announcement, user_email):
+    """O usuário recebe o comunicado? (todos menos o remetente, cadastrados até o envio)"""
+    user = users_db.get(user_email)
+    if user is None or user_email == announcement.get('from'):
+        return False
+    created_at = user.get('created_at')
+    return not created_at or created_at <= announcement.get('date', '')
+
+def announcement_view(announcement, user_email):
+    """Cópia do comunicado como o usuário a vê; None se ele o excluiu"""
+    state = users_db[user_email].get('announcements', {}).get(announcement.get('id'), {})
+    if state.get('deleted'):
+        return None
+
+    view = announcement.to_dict()
+    view.update({'to': user_email, 'read': False, 'starred': False})
+    view.update(state)
+    return view
+
+def is_announcement_view(email):
+    return not isinstance(email, EmailRecord) and bool(email.get('audience'))
+
+def update_announcement_state(view, changes):
+    """Grava no estado do usuário as alterações na sua cópia de um comunicado"""
+    with data_lock:
+        changes = changed_fields(view, changes)
+        if not changes:
+            return False
+
+        user_email = view['to']
+        states = users_db[user_email].setdefault('announcements', {})
+        states.setdefault(view['id'], {}).update(changes)
+        view.update(changes)
+        save_user(user_email)
+        change_log.record(user_email, view['id'], deleted=bool(changes.get('deleted')))
+        if changes.get('deleted'):
+            publish_email_event('deleted', view)
+        else:
+            publish_email_event('flag-change', view, changes=event_changes(changes))
+        return True
+
+def user_announcements(user_email):
+    """Cópias dos comunicados visíveis para o usuário"""
+    views = []
+    for announcement in list(announcements.values()):
+        if announcement_visible(announcement, user_email):
+            view = announcement_view(announcement, user_email)
+            if view is not None:
+                views.append(view)
+    return views
+
+def count_unread_announcements(user_email):
+    """Comunicados visíveis que o usuário não leu nem excluiu, direto do estado (sem montar cópias)"""
+    if not announcements:
+        return 0
+
+    states = users_db.get(user_email, {}).get('announcements', {})
+    unread = 0
+    for announcement_id, announcement in list(announcements.items()):
+        state = states.get(announcement_id, {})
+        if not state.get('read') and not state.get('deleted') and announcement_visible(announcement, user_email):
+            unread += 1
+    return unread
+
+def drop_announcement_states(announcement_id):
+    """Apaga de todos os usuários o estado de um comunicado removido (chamar com data_lock)"""
+    for user_email, user in users_db.items():
+        if user.get('announcements', {}).pop(announcement_id, None) is not None:
+            save_user(user_email)
+
+def announcement_postings(user_email, folder, after=None, before=None):
+    """(posting, cópia) dos comunicados que entram na pasta, do mais recente ao mais antigo"""
+    if folder not in ('inbox', 'starred') or not announcements:
+        return []
+
+    entries = []
+    for view in user_announcements(user_email):
+        posting = folder_posting(view)
+        if folder == 'starred' and not view.get('starred'):
+            continue
+        if (after is not None and posting[0] < after) or (before is not None and posting[0] >= before):
+            continue
+        entries.append((posting, view))
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    return entries
+
+def save_data(defer=False, wait=True):
+    """Persiste as alterações registradas desde o último commit.
+    defer=True: metadados de baixo valor, a gravação fica para o write_behind_flusher;
+    wait=False: com group commit, entra no próximo lote sem esperar a gravação"""
+    global deferred_since
+    with data_lock:
+        if not pending_changes:
+            persistence_stats['writes_avoided'] += 1
+            return
+
+        if defer and WRITE_BEHIND_SECONDS > 0 and SERVING_PROCESS:
+            if deferred_since is None:
+                deferred_since = time.monotonic()
+            persistence_stats['deferred'] += 1
+            return
+
+        if GROUP_COMMIT_MS <= 0 or not SERVING_PROCESS:
+            commit_changes()
+            return
+
+    # Group commit: entra no lote aberto e espera o group_committer gravar
+    with commit_cond:
+        batch = commit_batch
+        batch['requests'] += 1
+        commit_cond.notify_all()
+        if not wait:
+            return
+        while not batch['done']:
+            commit_cond.wait()
+
+    if batch['error']:
+        raise batch['error']
+
+def commit_changes():
+    """Grava no storage as alterações pendentes (chamar com data_lock)"""
+    global pending_changes, deferred_since
+    if not pending_changes:
+        return
+
+    storage.commit(users_db, emails_db)
+    pending_changes = 0
+    deferred_since = None
+    persistence_stats['writes'] += 1
+
+def flush_pending():
+    """Grava o que ficou pendente (lotes sem espera do group commit) no encerramento"""
+    with data_lock:
+        commit_changes()
+
+def flush_deferred():
+    """Grava as alterações adiadas pelo write-behind, se houver"""
+    with data_lock:
+        if deferred_since is not None:
+            commit_changes()
+
+def mark_changed():
+    """Registra que há alterações pendentes para o próximo save_data()"""
+    global pending_changes
+    pending_changes += 1
+
+def changed_fields(record, changes):
+    """Filtra só os campos cujo valor realmente muda"""
+    changed = {key: value for key, value in changes.items() if record.get(key, MISSING) != value}
+    if not changed:
+        persistence_stats['unchanged_updates'] += 1
+    return changed
+
+def ensure_mailbox(address):
+    """Carrega sob demanda a caixa postal de um endereço (persistência em shards)"""
+    if not storage.lazy:
+        return
+    with data_lock:
+        start = len(emails_db)
+        emails_db.extend(storage.load_mailbox(address))
+        index_emails(start)
+
+def ensure_all_mailboxes():
+    """Carrega todas as caixas postais (visões administrativas)"""
+    if not storage.lazy:
+        return
+    with data_lock:
+        start = len(emails_db)
+        emails_db.extend(storage.load_all_mailboxes())
+        index_emails(start)
+
+def insert_email(email):
+    """Adiciona um email ao banco e registra a alteração; retorna o registro guardado"""
+    if not isinstance(email, EmailRecord):
+        email = EmailRecord(email)
+
+    with data_lock:
+        ensure_mailbox(email.get('to'))
+        ensure_mailbox(email.get('from'))
+        emails_db.append(email)
+        email_positions[email.get('id')] = len(emails_db) - 1
+        if email.get('audience'):
+            announcements[email.get('id')] = email
+        if email_columns is not None:
+            email_columns.set_row(len(emails_db) - 1, email)
+        index_email_folders(email)
+        count_unread(email, 1)
+        for index in text_indexes:
+            index.add(email)
+        schedule_expiry(email)
+        record_email_change(email)
+        storage.insert_email(email)
+        mark_changed()
+        publish_email_event('new-mail', email, **{key: email.get(key) for key in NEW_MAIL_FIELDS})
+        return email
+
+def update_email(email, **changes):
+    """Altera campos de um email e registra a alteração (se algum valor mudou)"""
+    if is_announcement_view(email):
+        return update_announcement_state(email, changes)
+
+    with data_lock:
+        # Excluído entre o find_email da rota e esta chamada: nada a alterar
+        position = email_positions.get(email.get('id'))
+        if position is None or emails_db[position] is not email:
+            return False
+
+        changes = changed_fields(email, changes)
+        if not changes:
+            return False
+
+        owners = email_mailboxes(email) if not OWNER_FIELDS.isdisjoint(changes) else None
+        reindex = not FOLDER_FIELDS.isdisjoint(changes)
+        recount = not UNREAD_FIELDS.isdisjoint(changes)
+        stale_indexes = [index for index in text_indexes if not index.fields.isdisjoint(changes)]
+        if reindex:
+            unindex_email_folders(email)
+        if recount:
+            count_unread(email, -1)
+        for index in stale_indexes:
+            index.remove(email)
+        email.update(changes)
+        if reindex:
+            index_email_folders(email)
+        if recount:
+            count_unread(email, 1)
+        for index in stale_indexes:
+            index.add(email)
+        if email_columns is not None and not COLUMN_FIELDS.isdisjoint(changes):
+            email_columns.set_row(email_positions[email.get('id')], email)
+        if 'verification_expires' in changes:
+            schedule_expiry(email)
+        record_email_change(email)
+        if owners:
+            # Saiu de alguma caixa (remetente/destinatário trocado): lá conta como exclusão
+            for mailbox in set(owners) - set(email_mailboxes(email)):
+                change_log.record(mailbox, email.get('id'), deleted=True)
+        storage.update_email(email, changes)
+        mark_changed()
+        publish_email_event('flag-change', email, changes=event_changes(changes))
+        return True
+
+def remove_email(email):
+    """Remove um email do banco (tombstone) e registra a alteração"""
+    global tombstones
+    if is_announcement_view(email):
+        update_announcement_state(email, {'deleted': True})
+        return
+
+    with data_lock:
+        position = email_positions.pop(email.get('id'), None)
+        if position is None:
+            return
+
+        if announcements.pop(email.get('id'), None) is not None:
+            drop_announcement_states(email.get('id'))
+        emails_db[position] = None
+        tombstones += 1
+        if email_columns is not None:
+            email_columns.clear_row(position)
+        unindex_email_folders(email)
+        count_unread(email, -1)
+        for index in text_indexes:
+            index.remove(email)
+        storage.delete_email(email)
+        record_email_change(email, deleted=True)
+        publish_email_event('deleted', email)
+        email.release()
+        if body_pool.needs_compaction():
+            body_pool.compact()
+        mark_changed()
+
+        # Compactação amortizada: só quando os tombstones são uma fração relevante
+        if tombstones >= TOMBSTONE_COMPACT_MIN and tombstones * 4 >= len(emails_db):
+            compact_emails()
+
+# Eventos ao vivo: cada alteração avisa só as conexões de quem vê o email
+NEW_MAIL_FIELDS = ('from', 'to', 'subject', 'date')
+
+def email_audience(email):
+    """Usuários que veem o email (comunicados: todos os conectados que o recebem)"""
+    if isinstance(email, EmailRecord) and email.get('audience'):
+        return [user_email for user_email in event_hub.listeners()
+                if announcement_visible(email, user_email)] + [email.get('from')]
+    return [address for address in (email.get('to'), email.get('from')) if isinstance(address, str)]
+
+def publish_email_event(name, email, **data):
+    """Publica um evento do email para os usuários que o veem"""
+    if not event_hub.channels:
+        return
+    event_hub.publish(email_audience(email), name, {'id': email.get('id'), **data})
+
+def event_changes(changes):
+    """Campos alterados que vão no evento (o corpo fica de fora)"""
+    return {key: value for key, value in changes.items() if key != 'body'}
+
+def schedule_expiry(email):
+    """Agenda o evento de expiração de um email de verificação ainda válido"""
+    expires = email.timestamp('verification_expires') if isinstance(email, EmailRecord) else None
+    if expires is None or expires <= parse_timestamp(datetime.now().isoformat()):
+        return
+    with expiry_cond:
+        heapq.heappush(expiry_queue, (expires, email.get('id')))
+        expiry_cond.notify()
+
+def expiry_notifier():
+    """Publica 'verification-expired' quando vence o prazo de uma verificação"""
+    while True:
+        with expiry_cond:
+            while not expiry_queue:
+                expiry_cond.wait()
+            expires, email_id = expiry_queue[0]
+            delay = (expires - parse_timestamp(datetime.now().isoformat())) / 1e6
+            if delay > 0:
+                expiry_cond.wait(delay)
+                continue
+            heapq.heappop(expiry_queue)
+
+        with data_lock:
+            email = find_email(email_id)
+            # Email excluído ou prazo alterado depois do agendamento: ignora
+            if email is not None and email.timestamp('verification_expires') == expires:
+                publish_email_event('verification-expired', email, expires_at=email.get('verification_expires'))
+
+# Sincronização incremental: cada alteração entra no log das caixas do email
+def email_mailboxes(email):
+    """Caixas postais do email no log de alterações (comunicados: a caixa compartilhada)"""
+    if email.get('audience'):
+        return [ANNOUNCEMENT_MAILBOX]
+    return [address for address in (email.get('to'), email.get('from')) if isinstance(address, str)]
+
+def record_email_change(email, deleted=False):
+    for mailbox in email_mailboxes(email):
+        change_log.record(mailbox, email.get('id'), deleted=deleted)
+
+def mailbox_snapshot(user_email):
+    """Todas as mensagens da caixa do usuário (sincronização completa)"""
+    ids = set()
+    for postings in folder_index.get(user_email, {}).values():
+        ids.update(email_id for _, email_id in postings)
+    emails = [find_email(email_id) for email_id in ids]
+    emails = [email for email in emails if email is not None] + user_announcements(user_email)
+    return sorted(emails, key=folder_posting, reverse=True)
+
+def mailbox_delta(user_email, since):
+    """(alteradas, ids excluídos) desde a sequência 'since'; None se é preciso a caixa inteira"""
+    own = change_log.changes(user_email, since)
+    shared = change_log.changes(ANNOUNCEMENT_MAILBOX, since)
+    if own is None or shared is None:
+        return None
+
+    latest = {}   # id -> excluído, na ordem da última alteração
+    for email_id, _, deleted in heapq.merge(own, shared, key=lambda entry: entry[1]):
+        latest.pop(email_id, None)
+        latest[email_id] = deleted
+
+    changed, deleted_ids = [], []
+    for email_id, deleted in latest.items():
+        announcement = announcements.get(email_id)
+        if (announcement is not None and announcement.get('from') != user_email
+                and not announcement_visible(announcement, user_email)):
+            continue  # comunicado que o usuário não recebe: nunca esteve na caixa
+
+        email = None if deleted else find_email(email_id, user_email)
+        if email is None:
+            deleted_ids.append(email_id)
+        else:
+            changed.append(email)
+    return changed, deleted_ids
+
+def save_user(user_email):
+    """Registra alteração no cadastro de um usuário"""
+    with data_lock:
+        storage.save_user(user_email, users_db[user_email])
+        change_log.touch(USERS_VERSION)
+        mark_changed()
+
+def update_user(user_email, **changes):
+    """Altera campos de um usuário e registra a alteração (se algum valor mudou)"""
+    with data_lock:
+        user = users_db[user_email]
+        changes = changed_fields(user, changes)
+        if not changes:
+            return False
+
+        user.update(changes)
+        save_user(user_email)
+        return True
+
+def journal_compactor():
+    """Consolida periodicamente o journal no snapshot"""
+    while True:
+        time.sleep(JOURNAL_COMPACT_INTERVAL)
+        try:
+            with data_lock:
+                if storage.needs_compaction():
+                    compact_emails()
+                    if storage.compact(users_db, emails_db):
+                        print("📒 Journal compactado no snapshot")
+        except Exception as e:
+            print(f"Erro ao compactar journal: {e}")
+
+def write_behind_flusher():
+    """Grava em lote as alterações adiadas quando passam de WRITE_BEHIND_SECONDS"""
+    while True:
+        time.sleep(min(WRITE_BEHIND_SECONDS, 1))
+        try:
+            with data_lock:
+                if deferred_since is not None and time.monotonic() - deferred_since >= WRITE_BEHIND_SECONDS:
+                    commit_changes()
+        except Exception as e:
+            print(f"Erro ao gravar alterações adiadas: {e}")
+
+def group_committer():
+    """Grava num único commit todos os pedidos que chegam dentro da janela
+    GROUP_COMMIT_MS e libera juntas as requisições que esperavam"""
+    global commit_batch
+    while True:
+        with commit_cond:
+            while not commit_batch['requests']:
+                commit_cond.wait()
 
-    if os.path.exists(EMAILS_FILE):
-        with open(EMAILS_FILE, 'r', encoding='utf-8') as f:
-            emails_db = json.load(f)
+        # Janela para juntar as gravações que chegam em rajada
+        time.sleep(GROUP_COMMIT_MS / 1000)
 
-def save_data():
-    """Salva dados nos arquivos JSON"""
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users_db, f, ensure_ascii=False, indent=2)
+        with commit_cond:
+            batch = commit_batch
+            commit_batch = {'requests': 0, 'done': False, 'error': None}
 
-    with open(EMAILS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(emails_db, f, ensure_ascii=False, indent=2)
+        try:
+            with data_lock:
+                commit_changes()
+        except Exception as e:
+            print(f"Erro no group commit: {e}")
+            batch['error'] = e
+
+        with commit_cond:
+            batch['done'] = True
+            persistence_stats['group_commits'] += 1
+            persistence_stats['grouped_requests'] += batch['requests']
+            commit_cond.notify_all()
 
 def create_admin_user():
     """Cria usuário administrador"""
     # Sempre atualizar o usuário admin para garantir que existe
-    users_db[ADMIN_EMAIL] = {
+    admin_user = {
         'email': ADMIN_EMAIL,
         'name': 'Administrador NayEmail',
         'password': hashlib.md5('admin123'.encode()).hexdigest(),
@@ -90,20 +891,24 @@ def create_admin_user():
         'language': 'pt-BR',
         'signature': 'Administrador NayEmail\nSistema de Email Inteligente'
     }
+    if users_db.get(ADMIN_EMAIL) != admin_user:
+        users_db[ADMIN_EMAIL] = admin_user
+        save_user(ADMIN_EMAIL)
     save_data()
 
 def create_demo_emails():
     """Criar emails de demonstração para conta demo"""
     demo_email = 'vídeo@n'
+    ensure_mailbox(demo_email)
 
     # Verificar se já existem emails demo
-    existing_demo = [e for e in emails_db if e.get('to') == demo_email or e.get('demo_email')]
+    existing_demo = [e for e in iter_emails() if e.get('to') == demo_email or e.get('demo_email')]
     if len(existing_demo) > 0:
         return
 
     demo_emails = [
         {
-            'id': str(uuid.uuid4()),
+            'id': new_email_id(),
             'from': 'sistema@nayemail.com',
             'to': demo_email,
             'subject': '🎉 Bem-vindo ao NayEmail!',
@@ -138,7 +943,7 @@ Sistema NayEmail
             'demo_email': True
         },
         {
-            'id': str(uuid.uuid4()),
+            'id': new_email_id(),
             'from': 'verificacao@empresademo.nay.com',
             'to': demo_email,
             'subject': '🔐 Código de Verificação - Empresa Demo',
@@ -165,7 +970,7 @@ Sistema de Verificação Automática
             'demo_email': True
         },
         {
-            'id': str(uuid.uuid4()),
+            'id': new_email_id(),
             'from': 'IA@nayemail.com',
             'to': demo_email,
             'subject': '🤖 Sua Assistente IA está pronta!',
@@ -201,7 +1006,8 @@ Powered by NayEmail System
         }
     ]
 
-    emails_db.extend(demo_emails)
+    for demo in demo_emails:
+        insert_email(demo)
     save_data()
 
 def get_current_user():
@@ -214,9 +1020,10 @@ def get_current_user():
         if user_email in users_db:
             user = users_db[user_email]
             if user.get('user_id') == user_id:
+                ensure_mailbox(user_email)
                 # Garantir que o admin está sempre marcado como admin
-                if user_email == ADMIN_EMAIL:
-                    user['is_admin'] = True
+                if user_email == ADMIN_EMAIL and not user.get('is_admin'):
+                    update_user(user_email, is_admin=True)
                     save_data()
                 return user
     return None
@@ -229,20 +1036,22 @@ def generate_business_email(company_name, email_type='noreply'):
 def register_company_domain(company_name, company_info):
     """Registra uma empresa para usar subdomínio personalizado"""
     domain_key = company_name.lower().replace(' ', '')
-    registered_companies[domain_key] = {
-        'name': company_name,
-        'subdomain': f"{domain_key}.{BUSINESS_DOMAIN}",
-        'registered_at': datetime.now().isoformat(),
-        'email_types': ['noreply', 'suporte', 'verificacao', 'notificacoes'],
-        'info': company_info
-    }
-    save_companies_data()
-    return registered_companies[domain_key]
+    with data_lock:
+        registered_companies[domain_key] = {
+            'name': company_name,
+            'subdomain': f"{domain_key}.{BUSINESS_DOMAIN}",
+            'registered_at': datetime.now().isoformat(),
+            'email_types': ['noreply', 'suporte', 'verificacao', 'notificacoes'],
+            'info': company_info
+        }
+        save_companies_data()
+        return registered_companies[domain_key]
 
 def save_companies_data():
     """Salva dados das empresas registradas"""
-    with open('companies.json', 'w', encoding='utf-8') as f:
-        json.dump(registered_companies, f, ensure_ascii=False, indent=2)
+    with data_lock:
+        with open('companies.json', 'w', encoding='utf-8') as f:
+            json.dump(registered_companies, f, ensure_ascii=False, indent=2)
 
 def load_companies_data():
     """Carrega dados das empresas registradas"""
@@ -251,45 +1060,232 @@ def load_companies_data():
         with open('companies.json', 'r', encoding='utf-8') as f:
             registered_companies = json.load(f)
 
-def get_user_emails(user_email, folder='inbox'):
-    """Obtém emails do usuário por pasta"""
-    user_emails = []
+def get_user_emails(user_email, folder='inbox', after=None, before=None):
+    """Obtém emails do usuário por pasta (mais recentes primeiro)"""
+    ensure_mailbox(user_email)
 
-    # Verificar se emails_db existe e é uma lista
-    if not emails_db or not isinstance(emails_db, list):
-        print(f"emails_db não inicializado corretamente: {type(emails_db)}")
-        return []
+    with data_lock:
+        return list(iter_folder(user_email, folder, after, before))
 
-    for email in emails_db:
-        try:
-            # Verificar se email é um dicionário válido
-            if not isinstance(email, dict):
-                continue
+def search_user_emails(user_email, query, after=None, before=None):
+    """Busca nos emails do usuário: operadores (from:, is:unread, before: ...) e texto livre"""
+    ensure_mailbox(user_email)
 
-            if folder == 'inbox' and email.get('to') == user_email:
-                user_emails.append(email)
-            elif folder == 'sent' and email.get('from') == user_email:
-                user_emails.append(email)
-            elif folder == 'drafts' and email.get('folder') == 'drafts' and email.get('from') == user_email:
-                user_emails.append(email)
-            elif folder == 'starred' and email.get('starred') and (email.get('to') == user_email or email.get('from') == user_email):
-                user_emails.append(email)
-        except Exception as e:
-            print(f"Erro ao processar email: {e}")
-            continue
+    with data_lock:
+        filters, text = parse_search_query(query)
+        candidate_ids = match_filters(user_email, filters) if filters else None
+        if after is not None or before is not None:
+            ids = date_range_ids(user_email, after, before)
+            candidate_ids = ids if candidate_ids is None else candidate_ids & ids
+
+        if candidate_ids is not None and not text:
+            results = [find_email(email_id) for email_id in candidate_ids]
+        else:
+            results = text_search(user_email, text, candidate_ids)
+
+        if not filters:
+            # Sem palavras a busca por substring já percorre a caixa de entrada (com os comunicados)
+            found = {email.get('id') for email in results if email is not None}
+            results.extend(view for _, view in announcement_postings(user_email, 'inbox', after, before)
+                           if view['id'] not in found and (not text or announcement_matches(view, text)))
+
+        return sorted((e for e in results if e is not None), key=folder_posting, reverse=True)
+
+def match_filters(user_email, filters):
+    """Interseção dos ids que atendem a todos os operadores da consulta"""
+    result = None
+    for name, value in filters:
+        ids = filter_ids(user_email, name, value)
+        result = ids if result is None else result & ids
+        if not result:
+            break
+    return result
+
+def filter_ids(user_email, name, value):
+    """Ids que atendem a um operador, lidos dos índices de marcadores e de datas"""
+    if name in ('before', 'after'):
+        date = parse_time_param(name, value)
+        return date_range_ids(user_email, after=date if name == 'after' else None,
+                              before=date if name == 'before' else None)
+
+    if name in PREFIX_OPERATORS:
+        result = None
+        for token in tokenize(value):
+            ids = tag_index.prefix_ids(user_email, f"{name}:{token}")
+            result = ids if result is None else result & ids
+        return result if result is not None else set()
+
+    return tag_index.term_ids(user_email, f"{name}:{fold_text(value)}")
+
+def parse_time_param(name, value):
+    """Data de before/after: ISO (AAAA-MM-DD, AAAA/MM/DD, data e hora) ou epoch em
+    milissegundos; devolve microssegundos desde 1970 (ValueError se inválida)"""
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value) * 1000
+
+    timestamp = parse_timestamp(value.replace('/', '-'))
+    if timestamp is None:
+        raise ValueError(f'Data inválida em {name}: {value}')
+    return timestamp
+
+def get_time_range(params):
+    """Extrai after/before dos parâmetros da requisição (None quando ausentes)"""
+    after = parse_time_param('after', params['after']) if params.get('after') else None
+    before = parse_time_param('before', params['before']) if params.get('before') else None
+    return after, before
+
+def date_range_ids(user_email, after=None, before=None):
+    """Ids dos emails do usuário com data em [after, before), pelos índices de pasta"""
+    ids = set()
+    for folder in ('inbox', 'sent'):
+        postings = folder_index.get(user_email, {}).get(folder, [])
+        start, end = folder_range(postings, after, before)
+        ids.update(email_id for _, email_id in postings[start:end])
+    return ids
+
+def text_search(user_email, text, candidate_ids=None):
+    """Texto livre: índice de palavras ou de trigramas, conforme NAYEMAIL_SEARCH"""
+    if SEARCH_MODE == 'substring':
+        email_ids = trigram_index.candidates(user_email, text.lower())
+        if candidate_ids is not None:
+            email_ids = candidate_ids if email_ids is None else email_ids & candidate_ids
+        return substring_filter(user_email, text, email_ids)
+
+    email_ids = search_index.search(user_email, text)
+    if email_ids is None:
+        # Consulta sem palavras (vazia ou só símbolos): busca por substring
+        return substring_filter(user_email, text, candidate_ids)
+
+    if candidate_ids is not None:
+        email_ids &= candidate_ids
+    return [find_email(email_id) for email_id in email_ids]
+
+def announcement_matches(view, text):
+    """Texto livre aplicado a um comunicado, com a mesma semântica dos índices"""
+    terms = tokenize(text)
+    if SEARCH_MODE == 'substring' or not terms:
+        return email_contains(view, text.lower())
+    tokens = email_tokens(view)
+    return all(any(token.startswith(term) for token in tokens) for term in terms)
+
+def substring_filter(user_email, text, email_ids=None):
+    """Verificação exata de `query in texto` nos candidatos (ou em toda a caixa do usuário)"""
+    query = text.lower()
+    if email_ids is None:
+        candidates = iter_mailbox(user_email)
+    else:
+        candidates = (find_email(email_id) for email_id in email_ids)
+    return [e for e in candidates if e is not None and email_contains(e, query)]
+
+def iter_mailbox(user_email):
+    """Percorre os emails enviados ou recebidos pelo usuário"""
+    seen = set()
+    for folder in ('inbox', 'sent'):
+        for email in iter_folder(user_email, folder):
+            if email.get('id') not in seen:
+                seen.add(email.get('id'))
+                yield email
+
+def encode_cursor(posting):
+    """Gera o cursor de paginação (data + id) do último email entregue"""
+    return base64.urlsafe_b64encode(json.dumps(list(posting)).encode()).decode()
+
+def decode_cursor(cursor):
+    """Lê um cursor de paginação; ValueError se for inválido. Aceita também o
+    id (ordenável por tempo) de um email existente: a página segue a partir dele"""
+    if is_ulid(cursor):
+        email = find_email(cursor)
+        if email is None:
+            raise ValueError('Cursor inválido')
+        return folder_posting(email)
 
     try:
-        return sorted(user_emails, key=lambda x: x.get('date', ''), reverse=True)
-    except Exception as e:
-        print(f"Erro ao ordenar emails: {e}")
-        return user_emails
+        date, email_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if isinstance(date, str):
+            # Cursores gerados antes das datas inteiras
+            date = parse_timestamp(date) if date else -1
+        return (int(date), str(email_id))
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+def get_page_params(params):
+    """Extrai limit e cursor dos parâmetros; None se a paginação não foi pedida"""
+    if 'limit' not in params and 'cursor' not in params:
+        return None
+
+    try:
+        limit = int(params.get('limit') or PAGE_SIZE_DEFAULT)
+    except (TypeError, ValueError):
+        raise ValueError('Limite inválido')
+
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+    cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    return limit, cursor
+
+def paginate_folder(user_email, folder, limit, cursor=None, after=None, before=None):
+    """Página de uma pasta do usuário, lida direto do índice ordenado por data"""
+    ensure_mailbox(user_email)
+
+    with data_lock:
+        postings = folder_index.get(user_email, {}).get(folder, [])
+        first, last = folder_range(postings, after, before)
+        end = min(last, bisect_left(postings, cursor)) if cursor else last
+        start = max(first, end - limit)
+
+        # Comunicados entram na página pela mesma ordem (data + id)
+        extra = announcement_postings(user_email, folder, after, before)
+        total = last - first + len(extra)
+        if cursor:
+            extra = [entry for entry in extra if entry[0] < cursor]
+        entries = heapq.merge(((posting, None) for posting in reversed(postings[start:end])), extra,
+                              key=lambda entry: entry[0], reverse=True)
+        entries = list(islice(entries, limit))
+        has_more = (end - first) + len(extra) > len(entries)
+
+        page = [view if view is not None else find_email(posting[1]) for posting, view in entries]
+        return {
+            'emails': [e for e in page if e is not None],
+            'total': total,
+            'has_more': has_more,
+            'next_cursor': encode_cursor(entries[-1][0]) if has_more else None
+        }
+
+def paginate_results(results, limit, cursor=None):
+    """Página de uma lista de resultados, ordenada como as pastas (data + id)"""
+    ordered = sorted(results, key=folder_posting, reverse=True)
+    if cursor:
+        ordered = [e for e in ordered if folder_posting(e) < cursor]
+
+    page = ordered[:limit]
+    has_more = len(ordered) > limit
+
+    return {
+        'emails': page,
+        'total': len(results),
+        'has_more': has_more,
+        'next_cursor': encode_cursor(folder_posting(page[-1])) if has_more else None
+    }
+
+# Inicializar dados (o group_committer já precisa estar rodando para os primeiros save_data)
+if GROUP_COMMIT_MS > 0 and SERVING_PROCESS:
+    threading.Thread(target=group_committer, daemon=True).start()
+    atexit.register(flush_pending)
 
-# Inicializar dados
 load_data()
 load_companies_data()
 create_admin_user()
 create_demo_emails()
 
+if SERVING_PROCESS:
+    if storage.name == 'journal':
+        threading.Thread(target=journal_compactor, daemon=True).start()
+    threading.Thread(target=expiry_notifier, daemon=True).start()
+
+if WRITE_BEHIND_SECONDS > 0 and SERVING_PROCESS:
+    threading.Thread(target=write_behind_flusher, daemon=True).start()
+    atexit.register(flush_deferred)
+
 @app.route('/')
 def index():
     """Página principal com verificação de login"""
@@ -378,8 +1374,8 @@ def login():
     session['is_admin'] = user.get('is_admin', False)
 
     # Atualizar último login
-    user['last_login'] = datetime.now().isoformat()
-    save_data()
+    update_user(email, last_login=datetime.now().isoformat())
+    save_data(defer=True)
 
     print(f"Login realizado: {email}, Admin: {user.get('is_admin', False)}")
 
@@ -423,25 +1419,24 @@ def get_user_info():
             print("emails_db não inicializado, carregando dados...")
             load_data()
 
-        # Calcular contadores com tratamento de erro
-        try:
-            inbox_count = len([e for e in get_user_emails(user_email, 'inbox') if not e.get('read')])
-            sent_count = len(get_user_emails(user_email, 'sent'))
-            drafts_count = len(get_user_emails(user_email, 'drafts'))
-        except Exception as e:
-            print(f"Erro ao calcular contadores: {e}")
-            inbox_count = sent_count = drafts_count = 0
+        etag = mailbox_etag(user_email, 'user-info', change_log.version(USERS_VERSION))
+        cached = not_modified(etag)
+        if cached:
+            return cached
 
-        return jsonify({
+        # Contadores mantidos incrementalmente junto com os índices
+        counts = get_mailbox_counts(user_email)
+
+        return tag_response(jsonify({
             'email': user_email,
             'name': user['name'],
             'user_id': user['user_id'],
-            'inbox_count': inbox_count,
-            'sent_count': sent_count,
-            'drafts_count': drafts_count,
+            'inbox_count': counts['inbox_count'],
+            'sent_count': counts['sent_count'],
+            'drafts_count': counts['drafts_count'],
             'profile_pic': user.get('profile_pic', ''),
             'is_admin': user.get('is_admin', False)
-        })
+        }), etag)
     except Exception as e:
         print(f"Erro em get_user_info: {e}")
         return jsonify({'error': 'Erro interno do servidor'}), 500
@@ -454,8 +1449,136 @@ def get_emails(folder):
         return jsonify({'error': 'Usuário não logado'}), 401
 
     user_email = session.get('user_email')
-    emails = get_user_emails(user_email, folder)
-    return jsonify(emails)
+
+    # Com limit/cursor devolve uma página; sem eles, a lista completa (compatibilidade).
+    # after/before limitam o intervalo de datas
+    try:
+        page_params = get_page_params(request.args)
+        after, before = get_time_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    etag = mailbox_etag(user_email, 'emails', folder, sorted(request.args.items()))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    if page_params:
+        limit, cursor = page_params
+        return tag_response(emails_response(paginate_folder(user_email, folder, limit, cursor, after, before)), etag)
+
+    emails = get_user_emails(user_email, folder, after, before)
+    return tag_response(emails_response(emails), etag)
+
+@app.route('/api/events')
+def mailbox_events():
+    """Eventos ao vivo da caixa postal (Server-Sent Events): new-mail, flag-change,
+    deleted, verification-expired e resync (recarregar tudo)"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'Usuário não logado'}), 401
+
+    subscriber = event_hub.subscribe(session.get('user_email'))
+
+    def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                events = subscriber.wait(EVENTS_HEARTBEAT_SECONDS)
+                if not events:
+                    # Keep-alive: também detecta conexões fechadas pelo cliente
+                    yield ': ping\n\n'
+                for event in events:
+                    yield format_event(event)
+        finally:
+            event_hub.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# GET condicional: ETags fortes a partir dos contadores de versão das caixas
+# (change_log) ou do hash dos dicionários fixos; If-None-Match igual responde
+# 304 sem montar nem serializar a resposta
+def make_etag(*parts):
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+def static_etag(value):
+    return hashlib.blake2b(json.dumps(value, sort_keys=True).encode('utf-8'), digest_size=12).hexdigest()
+
+def mailbox_etag(user_email, *parts):
+    """ETag de uma resposta que depende da caixa do usuário (e dos comunicados)"""
+    return make_etag(user_email, change_log.version(user_email),
+                     change_log.version(ANNOUNCEMENT_MAILBOX), *parts)
+
+def not_modified(etag):
+    """Resposta 304 se o cliente já tem a versão da ETag; None caso contrário"""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    return tag_response(response, etag)
+
+def tag_response(response, etag, private=True):
+    """Marca a resposta com a ETag; no-cache faz o navegador revalidar a cada uso"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
+
+def static_response(name, value):
+    """Dicionário fixo com ETag pré-calculada"""
+    etag = STATIC_ETAGS[name]
+    return not_modified(etag) or tag_response(jsonify(value), etag, private=False)
+
+# ETags dos dicionários fixos, calculadas uma vez
+STATIC_ETAGS = {
+    'categories': static_etag(EMAIL_CATEGORIES),
+    'features': static_etag(FEATURES),
+    'themes': static_etag(THEMES)
+}
+
+# Listagens montadas com o JSON de cada email já serializado (records.json_fragment)
+def encode_email(email):
+    return app.json.dumps(email).encode('utf-8')
+
+def email_fragment(email):
+    if isinstance(email, EmailRecord):
+        return email.json_fragment(encode_email)
+    return encode_email(email)  # cópias de comunicados (montadas por usuário)
+
+def emails_response(payload):
+    """Resposta JSON de uma lista de emails, ou de um dict com a lista em 'emails'
+    (páginas, sincronização), concatenando os fragmentos"""
+    with data_lock:  # nenhum registro muda enquanto os fragmentos são lidos ou gravados
+        if isinstance(payload, list):
+            body = b'[' + b','.join(map(email_fragment, payload)) + b']'
+        else:
+            fields = {key: value for key, value in payload.items() if key != 'emails'}
+            body = (b'{"emails": [' + b','.join(map(email_fragment, payload['emails'])) + b']'
+                    + (b', ' + encode_email(fields)[1:] if fields else b'}'))
+    return app.response_class(body, mimetype=app.json.mimetype)
+
+@app.route('/api/sync')
+def sync_mailbox():
+    """Sincronização incremental: mensagens adicionadas, alteradas ou excluídas desde
+    a sequência 'since' (sem since, ou fora do histórico, devolve a caixa inteira)"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'Usuário não logado'}), 401
+
+    user_email = session.get('user_email')
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Sequência inválida'}), 400
+
+    ensure_mailbox(user_email)
+    with data_lock:
+        sequence = change_log.sequence
+        delta = mailbox_delta(user_email, since)
+        if delta is None:
+            return emails_response({'seq': sequence, 'reset': True, 'emails': mailbox_snapshot(user_email), 'deleted': []})
+
+        changed, deleted_ids = delta
+        return emails_response({'seq': sequence, 'reset': False, 'emails': changed, 'deleted': deleted_ids})
 
 @app.route('/api/email/<email_id>')
 def get_email_detail(email_id):
@@ -466,11 +1589,11 @@ def get_email_detail(email_id):
 
     user_email = session.get('user_email')
 
-    for email in emails_db:
-        if email.get('id') == email_id and (email.get('to') == user_email or email.get('from') == user_email):
-            email['read'] = True
-            save_data()
-            return jsonify(email)
+    email = find_email(email_id, user_email)
+    if email:
+        update_email(email, read=True)
+        save_data(defer=True)
+        return jsonify(email)
 
     return jsonify({'error': 'Email não encontrado'}), 404
 
@@ -488,7 +1611,7 @@ def send_email():
     user_email = session.get('user_email')
 
     new_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': user_email,
         'to': data['to'],
         'subject': data['subject'],
@@ -500,7 +1623,7 @@ def send_email():
         'highlighted': data.get('highlighted', False)
     }
 
-    emails_db.append(new_email)
+    insert_email(new_email)
     save_data()
 
     return jsonify({'success': True, 'message': 'Email enviado com sucesso'})
@@ -516,22 +1639,21 @@ def admin_broadcast():
     if not data or not all(k in data for k in ['subject', 'body']):
         return jsonify({'error': 'Subject e body são obrigatórios'}), 400
 
-    sent_count = 0
-    for user_email in users_db.keys():
-        if user_email != ADMIN_EMAIL:  # Não enviar para o próprio admin
-            broadcast_email = {
-                'id': str(uuid.uuid4()),
-                'from': ADMIN_EMAIL,
-                'to': user_email,
-                'subject': f"[SISTEMA] {data['subject']}",
-                'body': data['body'],
-                'date': datetime.now().isoformat(),
-                'read': False,
-                'starred': False,
-                'folder': 'inbox'
-            }
-            emails_db.append(broadcast_email)
-            sent_count += 1
+    # Um único comunicado; cada caixa de entrada o recebe na leitura (fan-out on read)
+    announcement = {
+        'id': new_email_id(),
+        'from': ADMIN_EMAIL,
+        'to': None,
+        'audience': 'all',  # todos os usuários cadastrados até o envio, menos o admin
+        'subject': f"[SISTEMA] {data['subject']}",
+        'body': data['body'],
+        'date': datetime.now().isoformat(),
+        'read': False,
+        'starred': False,
+        'folder': 'inbox'
+    }
+    insert_email(announcement)
+    sent_count = len(users_db) - (1 if ADMIN_EMAIL in users_db else 0)
 
     save_data()
     return jsonify({'success': True, 'sent_to': sent_count, 'message': f'Email enviado para {sent_count} usuários'})
@@ -543,11 +1665,17 @@ def admin_users():
     if not user or not user.get('is_admin'):
         return jsonify({'error': 'Acesso negado'}), 403
 
+    etag = make_etag('admin-users', change_log.version(USERS_VERSION))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     users_list = []
     for email, user_data in users_db.items():
         # Garantir que todos os usuários tenham user_id
         if 'user_id' not in user_data:
             user_data['user_id'] = f"user_{len(users_db) + 1:03d}"
+            save_user(email)
 
         users_list.append({
             'email': email,
@@ -558,7 +1686,31 @@ def admin_users():
         })
 
     save_data()  # Salvar as correções
-    return jsonify(users_list)
+    # Correções acima mudam a versão: a ETag é a de depois delas
+    etag = make_etag('admin-users', change_log.version(USERS_VERSION))
+    return tag_response(jsonify(users_list), etag)
+
+@app.route('/api/admin/storage-stats')
+def admin_storage_stats():
+    """Estatísticas de persistência (apenas admin)"""
+    user = get_current_user()
+    if not user or not user.get('is_admin'):
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    return jsonify({
+        'success': True,
+        'backend': storage.name,
+        'pending_changes': pending_changes,
+        'write_behind_seconds': WRITE_BEHIND_SECONDS,
+        'group_commit_ms': GROUP_COMMIT_MS,
+        'interned_addresses': len(addresses),
+        'body_store': {'mode': BODY_STORE, **(body_pool.store.stats if body_pool.store else {})},
+        'bodies': body_pool.summary(),
+        'json_cache': json_cache.summary() if json_cache is not None else None,
+        'events': event_hub.summary(),
+        'sync': change_log.summary(),
+        **persistence_stats
+    })
 
 @app.route('/api/admin/system-logs')
 def admin_system_logs():
@@ -568,8 +1720,16 @@ def admin_system_logs():
         return jsonify({'error': 'Acesso negado'}), 403
 
     # Filtrar emails de log do sistema
+    ensure_all_mailboxes()
+    if email_columns is not None:
+        with data_lock:
+            return jsonify(select_columns(
+                email_columns.equals('recipient', ADMIN_EMAIL) &
+                (email_columns.equals('sender', 'sistema@gmail.oficial') | email_columns.has_flag(FLAG_LOG))
+            ))
+
     system_logs = []
-    for email in emails_db:
+    for email in iter_emails():
         if email.get('to') == ADMIN_EMAIL and (
             email.get('from') == 'sistema@gmail.oficial' or 
             '[LOG]' in email.get('subject', '')
@@ -578,6 +1738,34 @@ def admin_system_logs():
 
     return jsonify(sorted(system_logs, key=lambda x: x.get('date', ''), reverse=True))
 
+@app.route('/api/admin/counters/check')
+def admin_check_counters():
+    """Verificar consistência dos contadores de caixa (apenas admin)"""
+    user = get_current_user()
+    if not user or not user.get('is_admin'):
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    ensure_all_mailboxes()
+    with data_lock:
+        mismatches = check_mailbox_counts()
+
+    return jsonify({'success': True, 'consistent': not mismatches, 'mismatches': mismatches})
+
+@app.route('/api/admin/counters/rebuild', methods=['POST'])
+def admin_rebuild_counters():
+    """Reconstruir índices e contadores a partir dos emails (apenas admin)"""
+    user = get_current_user()
+    if not user or not user.get('is_admin'):
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    ensure_all_mailboxes()
+    with data_lock:
+        mismatches = check_mailbox_counts()
+        compact_emails()
+        rebuild_email_index()
+
+    return jsonify({'success': True, 'fixed': len(mismatches), 'mismatches': mismatches})
+
 @app.route('/api/save-draft', methods=['POST'])
 def save_draft():
     """Salvar rascunho"""
@@ -589,7 +1777,7 @@ def save_draft():
     user_email = session.get('user_email')
 
     draft = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': user_email,
         'to': data.get('to', ''),
         'subject': data.get('subject', ''),
@@ -600,7 +1788,7 @@ def save_draft():
         'folder': 'drafts'
     }
 
-    emails_db.append(draft)
+    insert_email(draft)
     save_data()
 
     return jsonify({'success': True, 'draft_id': draft['id']})
@@ -612,20 +1800,14 @@ def delete_email(email_id):
     if not user:
         return jsonify({'error': 'Usuário não logado'}), 401
 
-    global emails_db
     user_email = session.get('user_email')
 
     # Verificar se o email pertence ao usuário
-    email_found = False
-    for email in emails_db:
-        if email.get('id') == email_id and (email.get('to') == user_email or email.get('from') == user_email):
-            email_found = True
-            break
-
+    email_found = find_email(email_id, user_email)
     if not email_found:
         return jsonify({'error': 'Email não encontrado'}), 404
 
-    emails_db = [e for e in emails_db if e.get('id') != email_id]
+    remove_email(email_found)
     save_data()
 
     return jsonify({'success': True, 'message': 'Email deletado'})
@@ -639,11 +1821,11 @@ def star_email(email_id):
 
     user_email = session.get('user_email')
 
-    for email in emails_db:
-        if email.get('id') == email_id and (email.get('to') == user_email or email.get('from') == user_email):
-            email['starred'] = not email.get('starred', False)
-            save_data()
-            return jsonify({'success': True, 'starred': email['starred']})
+    email = find_email(email_id, user_email)
+    if email:
+        update_email(email, starred=not email.get('starred', False))
+        save_data()
+        return jsonify({'success': True, 'starred': email['starred']})
 
     return jsonify({'error': 'Email não encontrado'}), 404
 
@@ -654,11 +1836,12 @@ def highlight_email(email_id):
     if not user or not user.get('is_admin'):
         return jsonify({'error': 'Acesso negado'}), 403
 
-    for email in emails_db:
-        if email.get('id') == email_id:
-            email['highlighted'] = not email.get('highlighted', False)
-            save_data()
-            return jsonify({'success': True, 'highlighted': email['highlighted']})
+    ensure_all_mailboxes()
+    email = find_email(email_id)
+    if email:
+        update_email(email, highlighted=not email.get('highlighted', False))
+        save_data()
+        return jsonify({'success': True, 'highlighted': email['highlighted']})
 
     return jsonify({'error': 'Email não encontrado'}), 404
 
@@ -669,7 +1852,12 @@ def get_highlighted_emails():
     if not user or not user.get('is_admin'):
         return jsonify({'error': 'Acesso negado'}), 403
 
-    highlighted = [email for email in emails_db if email.get('highlighted', False)]
+    ensure_all_mailboxes()
+    if email_columns is not None:
+        with data_lock:
+            return jsonify(select_columns(email_columns.has_flag(FLAG_HIGHLIGHTED)))
+
+    highlighted = [email for email in iter_emails() if email.get('highlighted', False)]
     return jsonify(sorted(highlighted, key=lambda x: x.get('date', ''), reverse=True))
 
 @app.route('/api/search', methods=['POST'])
@@ -680,23 +1868,25 @@ def search_emails():
         return jsonify({'error': 'Usuário não logado'}), 401
 
     data = request.get_json()
-    query = data.get('query', '').lower()
+    query = data.get('query', '')
     user_email = session.get('user_email')
 
-    results = []
-    for email in emails_db:
-        try:
-            if (email.get('to') == user_email or email.get('from') == user_email) and (
-                query in email.get('subject', '').lower() or 
-                query in email.get('body', '').lower() or 
-                query in email.get('from', '').lower()
-            ):
-                results.append(email)
-        except Exception as e:
-            print(f"Erro na busca: {e}")
-            continue
+    try:
+        after, before = get_time_range(data)
+        results = search_user_emails(user_email, query, after, before)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        page_params = get_page_params(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if page_params:
+        limit, cursor = page_params
+        return emails_response(paginate_results(results, limit, cursor))
 
-    return jsonify(results)
+    return emails_response(results)
 
 @app.route('/api/refresh-emails', methods=['POST'])
 def refresh_emails():
@@ -706,9 +1896,11 @@ def refresh_emails():
         return jsonify({'error': 'Usuário não logado'}), 401
 
     user_email = session.get('user_email')
-    inbox_emails = get_user_emails(user_email, 'inbox')
+    # Tamanho lido do índice da pasta (mais os comunicados), sem montar a lista
+    with data_lock:
+        count = len(folder_index.get(user_email, {}).get('inbox', [])) + len(announcement_postings(user_email, 'inbox'))
 
-    return jsonify({'success': True, 'count': len(inbox_emails)})
+    return jsonify({'success': True, 'count': count})
 
 @app.route('/api/external/send-verification', methods=['POST'])
 def send_verification_email():
@@ -794,7 +1986,7 @@ Clique no botão abaixo para verificar automaticamente:
 
     # Criar email de verificação avançado
     verification_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': from_email,
         'to': to_email,
         'subject': f"🔐 {config['label']} - {data['site_name']}",
@@ -822,7 +2014,7 @@ Clique no botão abaixo para verificar automaticamente:
         verification_email['highlighted'] = True
         verification_email['priority_highlight'] = True
 
-    emails_db.append(verification_email)
+    insert_email(verification_email)
     save_data()
 
     return jsonify({
@@ -867,7 +2059,7 @@ def send_reset_password_email():
 
     # Criar email de recuperação
     reset_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': from_email,
         'to': to_email,
         'subject': f"Recuperação de senha - {data['site_name']}",
@@ -895,7 +2087,7 @@ Este email foi enviado através do Sistema Gmail Independente.
         'site_origin': data['site_name']
     }
 
-    emails_db.append(reset_email)
+    insert_email(reset_email)
     save_data()
 
     return jsonify({
@@ -936,7 +2128,7 @@ def send_notification_email():
 
     # Criar email de notificação
     notification_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': from_email,
         'to': to_email,
         'subject': f"[{data['site_name']}] {data['subject']}",
@@ -955,7 +2147,7 @@ Site: {data['site_name']}
         'site_origin': data['site_name']
     }
 
-    emails_db.append(notification_email)
+    insert_email(notification_email)
     save_data()
 
     return jsonify({
@@ -1060,7 +2252,7 @@ Você está acessando recursos {verification_type} no {data['site_name']}.
 
     # Criar email avançado
     advanced_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': from_email,
         'to': to_email,
         'subject': f"{subject_emoji} Verificação {verification_type.title()} - {data['site_name']}",
@@ -1084,7 +2276,7 @@ Você está acessando recursos {verification_type} no {data['site_name']}.
         'custom_branding': custom_branding
     }
 
-    emails_db.append(advanced_email)
+    insert_email(advanced_email)
     save_data()
 
     return jsonify({
@@ -1176,8 +2368,8 @@ def validate_quick_login():
         return jsonify({'error': 'Conta banida', 'banned': True}), 403
 
     # Atualizar último login
-    user['last_login'] = datetime.now().isoformat()
-    save_data()
+    update_user(email, last_login=datetime.now().isoformat())
+    save_data(defer=True)
 
     # Criar sessão
     session['user_id'] = user['user_id']
@@ -1322,7 +2514,7 @@ def change_password_with_token():
         return jsonify({'error': 'Usuário não encontrado'}), 404
 
     # Atualizar senha
-    users_db[email]['password'] = hashlib.md5(new_password.encode()).hexdigest()
+    update_user(email, password=hashlib.md5(new_password.encode()).hexdigest())
     save_data()
 
     return jsonify({
@@ -1353,14 +2545,13 @@ def setup_security_questions():
         return jsonify({'error': 'Senha incorreta'}), 401
 
     # Salvar perguntas de segurança
-    user['security_questions'] = {
+    update_user(email, security_questions={
         'question1': question1,
         'answer1_hash': hashlib.md5(answer1.lower().encode()).hexdigest(),
         'question2': question2,
         'answer2_hash': hashlib.md5(answer2.lower().encode()).hexdigest(),
         'created_at': datetime.now().isoformat()
-    }
-
+    })
     save_data()
 
     return jsonify({
@@ -1416,6 +2607,7 @@ def register():
 
     users_db[email] = user_data
 
+    save_user(email)
     save_data()
 
     return jsonify({
@@ -1490,7 +2682,7 @@ def check_token_requests():
 
                 # Enviar resposta com link
                 response_email = {
-                    'id': str(uuid.uuid4()),
+                    'id': new_email_id(),
                     'from': ADMIN_EMAIL,
                     'to': email['from'],
                     'subject': f"✅ Link para Gerar Token - Sistema Gmail",
@@ -1527,10 +2719,10 @@ Este é um email automático do sistema.
                     'request_id': request_id
                 }
 
-                emails_db.append(response_email)
+                insert_email(response_email)
 
                 # Marcar email original como lido
-                email['read'] = True
+                update_email(email, read=True)
 
                 new_requests += 1
 
@@ -1639,7 +2831,7 @@ def request_human_support():
     
     # Enviar email para administrador
     support_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': 'sistema@nayemail.com',
         'to': ADMIN_EMAIL,
         'subject': f'🆘 Solicitação de Atendimento Humano - Ticket #{support_ticket_id}',
@@ -1684,7 +2876,7 @@ Tempo de resposta recomendado: 15 minutos.
         'priority': 'high'
     }
 
-    emails_db.append(support_email)
+    insert_email(support_email)
     save_data()
 
     return jsonify({
@@ -1883,7 +3075,7 @@ def generate_and_send_chat_transcript(user, chat_id):
 
         # Enviar relatório por email
         report_email = {
-            'id': str(uuid.uuid4()),
+            'id': new_email_id(),
             'from': 'sistema@nayemail.com',
             'to': user['email'],
             'subject': f"📊 Relatório Completo - Conversa NayAI ({chat_id[:8]})",
@@ -1897,7 +3089,7 @@ def generate_and_send_chat_transcript(user, chat_id):
             'priority': 'high'
         }
 
-        emails_db.append(report_email)
+        insert_email(report_email)
         save_data()
 
         print(f"Relatório de chat enviado para {user['email']}: {chat_id}")
@@ -1909,7 +3101,7 @@ def send_ai_notification_email(user, chat_id, user_message, ai_response):
     """Enviar notificação para a IA sobre nova mensagem"""
     try:
         ai_email = {
-            'id': str(uuid.uuid4()),
+            'id': new_email_id(),
             'from': 'sistema@nayemail.com',
             'to': 'IA@nayemail.com',
             'subject': f'💬 Nova conversa com {user["name"]} - Chat {chat_id[:8]}',
@@ -1943,7 +3135,7 @@ def send_ai_notification_email(user, chat_id, user_message, ai_response):
             'chat_id': chat_id
         }
 
-        emails_db.append(ai_email)
+        insert_email(ai_email)
         save_data()
 
     except Exception as e:
@@ -2033,7 +3225,7 @@ def generate_account_token():
 
     # Enviar confirmação por email
     confirmation_email = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': ADMIN_EMAIL,
         'to': email,
         'subject': f"🎉 Token Gerado com Sucesso - Sistema Gmail",
@@ -2077,7 +3269,7 @@ Este token é válido e pode ser usado para acessar nossa API.
         'user_token': user_token
     }
 
-    emails_db.append(confirmation_email)
+    insert_email(confirmation_email)
     save_data()
 
     return jsonify({
@@ -2181,9 +3373,8 @@ def mark_trailer_seen():
 
     user_email = session.get('user_email')
     if user_email in users_db and users_db[user_email].get('demo_account'):
-        users_db[user_email]['show_trailer'] = False
-        users_db[user_email]['trailer_seen_at'] = datetime.now().isoformat()
-        save_data()
+        update_user(user_email, show_trailer=False, trailer_seen_at=datetime.now().isoformat())
+        save_data(wait=False)
 
         return jsonify({
             'success': True,
@@ -2229,19 +3420,19 @@ def login_with_token():
     session['token_used'] = token[:16] + '...'  # Registrar parte do token usado
 
     # Atualizar último login
-    user['last_login'] = datetime.now().isoformat()
+    update_user(user_email, last_login=datetime.now().isoformat())
 
     # Registrar uso do token
     token_data['last_used'] = datetime.now().isoformat()
     token_data['usage_count'] = token_data.get('usage_count', 0) + 1
 
-    save_data()
+    save_data(defer=True)
 
     print(f"Login por token realizado: {user_email}, Admin: {user.get('is_admin', False)}, Token: {token[:8]}...")
 
     # Enviar email de notificação de login por token
     login_notification = {
-        'id': str(uuid.uuid4()),
+        'id': new_email_id(),
         'from': 'sistema@gmail.oficial',
         'to': user_email,
         'subject': f"🔐 Login por Token Realizado - {datetime.now().strftime('%d/%m/%Y %H:%M')}",
@@ -2276,7 +3467,7 @@ Para sua segurança, sempre verifique logins não autorizados.
         'security_alert': True
     }
 
-    emails_db.append(login_notification)
+    insert_email(login_notification)
     save_data()
 
     return jsonify({
@@ -2304,7 +3495,7 @@ def get_categories():
     if not user:
         return jsonify({'error': 'Usuário não logado'}), 401
 
-    return jsonify(EMAIL_CATEGORIES)
+    return static_response('categories', EMAIL_CATEGORIES)
 
 @app.route('/api/email/<email_id>/categorize', methods=['POST'])
 def categorize_email(email_id):
@@ -2321,11 +3512,11 @@ def categorize_email(email_id):
 
     user_email = session.get('user_email')
 
-    for email in emails_db:
-        if email.get('id') == email_id and (email.get('to') == user_email or email.get('from') == user_email):
-            email['category'] = category
-            save_data()
-            return jsonify({'success': True, 'category': category})
+    email = find_email(email_id, user_email)
+    if email:
+        update_email(email, category=category)
+        save_data()
+        return jsonify({'success': True, 'category': category})
 
     return jsonify({'error': 'Email não encontrado'}), 404
 
@@ -2337,16 +3528,20 @@ def snooze_email(email_id):
         return jsonify({'error': 'Usuário não logado'}), 401
 
     data = request.get_json()
-    snooze_until = data.get('snooze_until')
+    # Normaliza para o ISO local sem fuso das outras datas (toISOString() manda 'Z'),
+    # assim o registro guarda o horário como inteiro
+    timestamp = parse_timestamp(data.get('snooze_until'))
+    if timestamp is None:
+        return jsonify({'error': 'Data inválida em snooze_until'}), 400
+    snooze_until = timestamp_to_iso(timestamp)
 
     user_email = session.get('user_email')
 
-    for email in emails_db:
-        if email.get('id') == email_id and (email.get('to') == user_email or email.get('from') == user_email):
-            email['snoozed'] = True
-            email['snooze_until'] = snooze_until
-            save_data()
-            return jsonify({'success': True, 'snooze_until': snooze_until})
+    email = find_email(email_id, user_email)
+    if email:
+        update_email(email, snoozed=True, snooze_until=snooze_until)
+        save_data()
+        return jsonify({'success': True, 'snooze_until': snooze_until})
 
     return jsonify({'error': 'Email não encontrado'}), 404
 
@@ -2472,38 +3667,7 @@ def smart_reply():
 @app.route('/api/themes')
 def get_themes():
     """Obter temas disponíveis"""
-    themes = {
-        'default': {
-            'name': 'NayEmail Padrão',
-            'primary_color': '#6c63ff',
-            'secondary_color': '#4caf50',
-            'background': '#ffffff',
-            'text_color': '#333333'
-        },
-        'dark': {
-            'name': 'Modo Escuro',
-            'primary_color': '#bb86fc',
-            'secondary_color': '#03dac6',
-            'background': '#121212',
-            'text_color': '#ffffff'
-        },
-        'blue': {
-            'name': 'Azul Profissional',
-            'primary_color': '#1976d2',
-            'secondary_color': '#2196f3',
-            'background': '#f5f5f5',
-            'text_color': '#333333'
-        },
-        'green': {
-            'name': 'Verde Natureza',
-            'primary_color': '#388e3c',
-            'secondary_color': '#4caf50',
-            'background': '#e8f5e8',
-            'text_color': '#2e7d32'
-        }
-    }
-
-    return jsonify(themes)
+    return static_response('themes', THEMES)
 
 @app.route('/api/user/theme', methods=['POST'])
 def set_user_theme():
@@ -2516,8 +3680,8 @@ def set_user_theme():
     theme = data.get('theme', 'default')
 
     user_email = session.get('user_email')
-    users_db[user_email]['theme'] = theme
-    save_data()
+    update_user(user_email, theme=theme)
+    save_data(wait=False)
 
     return jsonify({'success': True, 'theme': theme})
 
@@ -2556,6 +3720,7 @@ def create_filter():
         users_db[user_email]['filters'] = []
 
     users_db[user_email]['filters'].append(filter_config)
+    save_user(user_email)
     save_data()
 
     return jsonify({'success': True, 'filter': filter_config})
@@ -2563,12 +3728,12 @@ def create_filter():
 @app.route('/api/features')
 def get_features():
     """Obter funcionalidades disponíveis"""
-    return jsonify(FEATURES)
+    return static_response('features', FEATURES)
 
 if __name__ == '__main__':
     print("📧 NayEmail - Sistema de Email Inteligente iniciado!")
     print(f"👑 Admin: {ADMIN_EMAIL} (senha: admin123)")
-    print(f"📬 Emails carregados: {len(emails_db)}")
+    print(f"📬 Emails carregados: {len(email_positions)}")
     print(f"👥 Usuários registrados: {len(users_db)}")
     print(f"🔑 Sistema de Token de Conta ativo!")
     print(f"🎨 Temas e funcionalidades avançadas disponíveis!")
@@ -0,0 +1,579 @@
+"""
+NayEmail - Camada de persistência
+Backends de armazenamento para usuários e emails
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from collections.abc import Mapping
+from urllib.parse import quote
+
+
+def write_json_atomic(path, data, indent=2):
+    """Grava JSON em arquivo temporário e substitui o original de forma atômica"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # por processo: dois gravadores não dividem o temporário
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent, default=dict)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path) or '.')
+
+
+def fsync_directory(directory):
+    """Torna durável a troca de nome do arquivo (onde o sistema permite abrir diretórios)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JsonStorage:
+    """Persistência original: reescreve users.json e emails.json a cada commit"""
+
+    name = 'json'
+    lazy = False
+    email_type = dict   # tipo dos emails carregados (o servidor usa o registro compacto)
+
+    def __init__(self, users_file, emails_file):
+        self.users_file = users_file
+        self.emails_file = emails_file
+        self.users_dirty = False
+        self.emails_dirty = False
+
+    def load(self):
+        """Carrega usuários e emails dos arquivos JSON"""
+        return self.load_users(), self.load_emails()
+
+    def load_users(self):
+        if os.path.exists(self.users_file):
+            with open(self.users_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def load_emails(self):
+        if os.path.exists(self.emails_file):
+            with open(self.emails_file, 'r', encoding='utf-8') as f:
+                return self.make_emails(json.load(f))
+        return []
+
+    def make_emails(self, emails):
+        """Converte os emails lidos do disco para email_type"""
+        return [self.email_type(e) if isinstance(e, dict) else e for e in emails]
+
+    # Carregamento sob demanda (só o backend em shards carrega caixas depois do load)
+    def load_mailbox(self, address):
+        return []
+
+    def load_all_mailboxes(self):
+        return []
+
+    # Registro de alterações (o backend JSON regrava no commit só o arquivo alterado)
+    def insert_email(self, email):
+        self.emails_dirty = True
+
+    def update_email(self, email, changes):
+        self.emails_dirty = True
+
+    def delete_email(self, email):
+        self.emails_dirty = True
+
+    def save_user(self, user_email, user):
+        self.users_dirty = True
+
+    def commit(self, users, emails):
+        """Salva dados nos arquivos JSON"""
+        if self.users_dirty:
+            with open(self.users_file, 'w', encoding='utf-8') as f:
+                json.dump(users, f, ensure_ascii=False, indent=2)
+            self.users_dirty = False
+
+        # Emails excluídos ficam como None (tombstone) na lista em memória
+        if self.emails_dirty:
+            with open(self.emails_file, 'w', encoding='utf-8') as f:
+                json.dump([e for e in emails if e is not None], f, ensure_ascii=False, indent=2, default=dict)
+            self.emails_dirty = False
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, users, emails):
+        pass
+
+
+class JournalStorage(JsonStorage):
+    """Persistência com journal: cada alteração vira um registro compacto no final
+    do arquivo de log, e o compactador consolida o log no snapshot periodicamente"""
+
+    name = 'journal'
+
+    def __init__(self, users_file, emails_file, journal_file, compact_bytes=4 * 1024 * 1024):
+        super().__init__(users_file, emails_file)
+        self.journal_file = journal_file
+        self.compact_bytes = compact_bytes
+        self.pending = []
+        self.journal_size = 0   # tamanho do journal após a última leitura/gravação deste processo
+        self.foreign_writes = False   # outro processo gravou no journal depois da nossa leitura
+
+    def load(self):
+        """Carrega o snapshot e reaplica os registros do journal"""
+        users, emails = super().load()
+
+        if not os.path.exists(self.journal_file):
+            self.journal_size = 0
+            return users, emails
+
+        emails_by_id = {e.get('id'): e for e in emails if isinstance(e, Mapping)}
+        deleted = set()
+        replayed = 0
+
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última linha incompleta (queda durante a escrita)
+                    print(f"Registro inválido ignorado no journal: {line[:80]}")
+                    continue
+                self._replay(record, users, emails, emails_by_id, deleted)
+                replayed += 1
+
+            self.journal_size = os.fstat(f.fileno()).st_size
+
+        if replayed:
+            print(f"📒 Journal: {replayed} registros reaplicados")
+
+        if deleted:
+            emails = [e for e in emails if id(e) not in deleted]
+        return users, emails
+
+    def _replay(self, record, users, emails, emails_by_id, deleted):
+        """Aplica um registro do journal (idempotente)"""
+        op = record.get('op')
+
+        if op == 'insert':
+            email = record['email']
+            existing = emails_by_id.get(email.get('id'))
+            if existing is not None:
+                existing.clear()
+                existing.update(email)
+            else:
+                email = self.email_type(email)
+                emails.append(email)
+                emails_by_id[email.get('id')] = email
+        elif op == 'update':
+            email = emails_by_id.get(record['id'])
+            if email is not None:
+                email.update(record['changes'])
+        elif op == 'delete':
+            email = emails_by_id.pop(record['id'], None)
+            if email is not None:
+                deleted.add(id(email))
+        elif op == 'user':
+            users[record['key']] = record['data']
+
+    def _append(self, record):
+        self.pending.append(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=dict))
+
+    def insert_email(self, email):
+        self._append({'op': 'insert', 'email': email})
+
+    def update_email(self, email, changes):
+        self._append({'op': 'update', 'id': email.get('id'), 'changes': changes})
+
+    def delete_email(self, email):
+        self._append({'op': 'delete', 'id': email.get('id')})
+
+    def save_user(self, user_email, user):
+        self._append({'op': 'user', 'key': user_email, 'data': user})
+
+    def commit(self, users, emails):
+        """Grava os registros pendentes no final do journal"""
+        if not self.pending:
+            return
+
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            if os.fstat(f.fileno()).st_size != self.journal_size:
+                self.foreign_writes = True
+            f.write('\n'.join(self.pending) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            self.journal_size = os.fstat(f.fileno()).st_size
+
+        self.pending = []
+
+    def needs_compaction(self):
+        return (os.path.exists(self.journal_file)
+                and os.path.getsize(self.journal_file) >= self.compact_bytes)
+
+    def compact(self, users, emails):
+        """Consolida o journal em um novo snapshot e trunca o log; False (sem
+        gravar nada) se o journal tem registros que este processo não conhece"""
+        self.commit(users, emails)
+        if self.foreign_writes or os.path.getsize(self.journal_file) != self.journal_size:
+            # Outro processo (ex.: o pai do reloader) grava no mesmo journal: o
+            # snapshot em memória daqui perderia as mensagens dele
+            print("⚠️ Journal alterado por outro processo: compactação cancelada")
+            return False
+
+        write_json_atomic(self.users_file, users)
+        write_json_atomic(self.emails_file, [e for e in emails if e is not None])
+
+        # A reaplicação é idempotente: se cair antes daqui, o journal antigo
+        # é reaplicado sobre o snapshot novo sem alterar o resultado
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+        self.journal_size = 0
+        return True
+
+
+class SQLiteStorage(JsonStorage):
+    """Persistência em SQLite (modo WAL): cada commit grava só as linhas alteradas
+    em uma transação. Com lazy, cada caixa é lida no primeiro acesso pelos
+    índices de destinatário e remetente"""
+
+    name = 'sqlite'
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        email TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS emails (
+        id TEXT PRIMARY KEY,
+        sender TEXT,
+        recipient TEXT,
+        folder TEXT,
+        date TEXT,
+        tracking_id TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_emails_recipient ON emails (recipient, folder, date);
+    CREATE INDEX IF NOT EXISTS idx_emails_sender ON emails (sender, date);
+    DROP INDEX IF EXISTS idx_emails_tracking;
+    """
+
+    def __init__(self, db_file, lazy=False, durable=False):
+        self.db_file = db_file
+        self.lazy = lazy
+        self.pending = []
+        self.loaded = set()       # endereços cujas caixas já foram lidas
+        self.loaded_ids = set()   # ids já entregues (mensagem entre dois endereços lidos)
+        self.all_loaded = False
+        # O acesso é serializado pelo data_lock do servidor
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # FULL sincroniza o WAL a cada commit (NORMAL só nos checkpoints)
+        self.conn.execute('PRAGMA synchronous=FULL' if durable else 'PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def load(self):
+        """Carrega usuários e emails do banco SQLite (com lazy, só os sem destinatário,
+        como os comunicados; as caixas ficam para o primeiro acesso)"""
+        users = {key: json.loads(data) for key, data in self.conn.execute('SELECT email, data FROM users')}
+        self.loaded = set()
+        self.loaded_ids = set()
+        self.all_loaded = not self.lazy
+        if not self.lazy:
+            return users, self._select('SELECT id, data FROM emails ORDER BY rowid')
+        return users, self._select('SELECT id, data FROM emails WHERE recipient IS NULL ORDER BY rowid')
+
+    def _select(self, sql, params=()):
+        """Emails das linhas (id, data) ainda não entregues ao servidor"""
+        rows = {}
+        for email_id, data in self.conn.execute(sql, params):
+            if email_id not in self.loaded_ids:
+                rows.setdefault(email_id, data)
+        self.loaded_ids.update(rows)
+        return self.make_emails(json.loads(data) for data in rows.values())
+
+    def load_mailbox(self, address):
+        """Lê as mensagens recebidas e enviadas por um endereço (índices por destinatário e remetente)"""
+        if not address or self.all_loaded or address in self.loaded:
+            return []
+        self.loaded.add(address)
+        return self._select('SELECT id, data FROM emails WHERE recipient = ? '
+                            'UNION ALL SELECT id, data FROM emails WHERE sender = ?', (address, address))
+
+    def load_all_mailboxes(self):
+        if self.all_loaded:
+            return []
+        self.all_loaded = True
+        return self._select('SELECT id, data FROM emails ORDER BY rowid')
+
+    def _email_row(self, email):
+        return (
+            email.get('id'),
+            email.get('from'),
+            email.get('to'),
+            email.get('folder'),
+            email.get('date'),
+            email.get('tracking_id'),
+            json.dumps(email, ensure_ascii=False, separators=(',', ':'), default=dict)
+        )
+
+    def insert_email(self, email):
+        self.loaded_ids.add(email.get('id'))
+        self.pending.append((
+            'INSERT OR REPLACE INTO emails (id, sender, recipient, folder, date, tracking_id, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self._email_row(email)
+        ))
+
+    def update_email(self, email, changes):
+        row = self._email_row(email)
+        self.pending.append((
+            'UPDATE emails SET sender = ?, recipient = ?, folder = ?, date = ?, tracking_id = ?, data = ? '
+            'WHERE id = ?',
+            row[1:] + row[:1]
+        ))
+
+    def delete_email(self, email):
+        self.pending.append(('DELETE FROM emails WHERE id = ?', (email.get('id'),)))
+
+    def save_user(self, user_email, user):
+        self.pending.append((
+            'INSERT OR REPLACE INTO users (email, data) VALUES (?, ?)',
+            (user_email, json.dumps(user, ensure_ascii=False, separators=(',', ':')))
+        ))
+
+    def commit(self, users, emails):
+        """Grava as alterações pendentes em uma única transação"""
+        if not self.pending:
+            return
+
+        with self.conn:
+            for sql, params in self.pending:
+                self.conn.execute(sql, params)
+
+        self.pending = []
+
+    def import_data(self, users, emails):
+        """Importa usuários e emails existentes (importação única a partir do JSON)"""
+        for user_email, user in users.items():
+            self.save_user(user_email, user)
+        for email in emails:
+            if isinstance(email, Mapping) and email.get('id'):
+                self.insert_email(email)
+        self.commit(users, emails)
+
+
+class ShardedStorage(JsonStorage):
+    """Persistência particionada por conversa: um arquivo por par remetente/destinatário
+    (ou por endereço, para mensagens a si mesmo ou sem o outro lado), mais um índice
+    endereço -> shards que permite carregar a caixa de qualquer endereço, cadastrado
+    ou não na hora do envio. O commit grava só os shards alterados e as caixas podem
+    ser carregadas sob demanda no primeiro acesso"""
+
+    name = 'sharded'
+    SHARED = '_shared'          # comunicados do admin (carregado no início)
+    INDEX = '_mailboxes.json'   # endereço -> [chaves dos shards com mensagens dele]
+    PAIR_SEPARATOR = '|'
+
+    def __init__(self, users_file, emails_file, shards_dir, lazy=True):
+        super().__init__(users_file, emails_file)
+        self.shards_dir = shards_dir
+        self.lazy = lazy
+        self.users = {}
+        self.shards = {}     # chave do shard -> {id: email}
+        self.location = {}   # id do email -> chave do shard
+        self.mailboxes = {}  # endereço -> {chaves dos shards}
+        self.loaded = set()  # endereços cujas caixas já foram carregadas
+        self.dirty = set()
+        self.index_dirty = False
+        self.users_dirty = False
+
+    def _path(self, key):
+        return os.path.join(self.shards_dir, quote(key, safe='@.') + '.json')
+
+    def _owners(self, email):
+        return {address for address in (email.get('from'), email.get('to')) if isinstance(address, str)}
+
+    def shard_key(self, email):
+        """Define em qual shard a mensagem é gravada: o da conversa entre remetente e destinatário"""
+        owners = self._owners(email)
+        if email.get('audience') or not owners:
+            # Comunicados valem para todas as caixas: ficam no shard carregado no início
+            return self.SHARED
+        return self.PAIR_SEPARATOR.join(sorted(owners))
+
+    def _place(self, key, email):
+        self.shards.setdefault(key, {})[email.get('id')] = email
+        self.location[email.get('id')] = key
+        if key != self.SHARED:
+            for address in self._owners(email):
+                keys = self.mailboxes.setdefault(address, set())
+                if key not in keys:
+                    keys.add(key)
+                    self.index_dirty = True
+
+    def _read_shard(self, key):
+        emails = []
+        path = self._path(key)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                emails = self.make_emails(json.load(f))
+
+        self.shards[key] = {}
+        for email in emails:
+            self._place(key, email)
+        return emails
+
+    def _write_shard(self, key):
+        emails = list(self.shards.get(key, {}).values())
+        if emails or os.path.exists(self._path(key)):
+            write_json_atomic(self._path(key), emails, indent=None)
+
+    def _write_index(self):
+        index = {address: sorted(keys) for address, keys in self.mailboxes.items()}
+        write_json_atomic(os.path.join(self.shards_dir, self.INDEX), index, indent=None)
+        self.index_dirty = False
+
+    def load(self):
+        """Carrega usuários, o índice e o shard compartilhado; as caixas ficam para o primeiro acesso"""
+        self.users = self.load_users()
+        self.shards = {}
+        self.location = {}
+        self.mailboxes = {}
+        self.loaded = set()
+        self.dirty = set()
+
+        index_path = os.path.join(self.shards_dir, self.INDEX)
+        if not os.path.exists(index_path):
+            return self.users, self._migrate()
+
+        with open(index_path, 'r', encoding='utf-8') as f:
+            self.mailboxes = {address: set(keys) for address, keys in json.load(f).items()}
+        self.index_dirty = False
+
+        emails = self._read_shard(self.SHARED)
+        if not self.lazy:
+            emails.extend(self.load_all_mailboxes())
+        return self.users, emails
+
+    def _migrate(self):
+        """Distribui os emails existentes (emails.json ou shards do formato antigo,
+        por endereço) nos shards por conversa; executado uma única vez"""
+        if os.path.isdir(self.shards_dir):
+            old_files = [name for name in os.listdir(self.shards_dir) if name.endswith('.json')]
+            emails = []
+            for name in old_files:
+                with open(os.path.join(self.shards_dir, name), 'r', encoding='utf-8') as f:
+                    emails.extend(self.make_emails(json.load(f)))
+        else:
+            old_files = []
+            emails = [e for e in self.load_emails() if isinstance(e, Mapping)]
+        os.makedirs(self.shards_dir, exist_ok=True)
+
+        self.shards[self.SHARED] = {}
+        for email in emails:
+            self._place(self.shard_key(email), email)
+
+        for key in self.shards:
+            self._write_shard(key)
+        keys = {os.path.basename(self._path(key)) for key in self.shards}
+        for name in old_files:
+            if name not in keys:
+                os.remove(os.path.join(self.shards_dir, name))
+        self._write_index()
+        self.loaded = set(self.mailboxes)
+
+        print(f"📦 {len(emails)} emails migrados para {len(self.shards)} shards em {self.shards_dir}/")
+        return emails
+
+    def load_mailbox(self, address):
+        """Carrega os shards (ainda não carregados) das conversas de um endereço"""
+        if not address or address in self.loaded:
+            return []
+
+        self.loaded.add(address)
+        emails = []
+        for key in sorted(self.mailboxes.get(address, ())):
+            if key not in self.shards:
+                emails.extend(self._read_shard(key))
+        return emails
+
+    def load_all_mailboxes(self):
+        """Carrega todos os shards ainda não carregados"""
+        emails = []
+        for address in list(self.mailboxes):
+            emails.extend(self.load_mailbox(address))
+        return emails
+
+    def insert_email(self, email):
+        key = self.shard_key(email)
+        if key not in self.shards:
+            self.shards[key] = {}
+            if os.path.exists(self._path(key)):
+                # Só acontece se alguém insere sem carregar as caixas antes (o servidor carrega)
+                self._read_shard(key)
+        self._place(key, email)
+        self.dirty.add(key)
+
+    def update_email(self, email, changes):
+        email_id = email.get('id')
+        key = self.location.get(email_id)
+        if key is None:
+            return
+
+        new_key = self.shard_key(email)
+        if new_key != key:
+            # Remetente ou destinatário trocado: a mensagem muda de conversa
+            self.shards[key].pop(email_id, None)
+            self.dirty.add(key)
+            if new_key not in self.shards and os.path.exists(self._path(new_key)):
+                self._read_shard(new_key)
+            self._place(new_key, email)
+            key = new_key
+        self.dirty.add(key)
+
+    def delete_email(self, email):
+        key = self.location.pop(email.get('id'), None)
+        if key is not None:
+            self.shards[key].pop(email.get('id'), None)
+            self.dirty.add(key)
+
+    def save_user(self, user_email, user):
+        self.users_dirty = True
+
+    def commit(self, users, emails):
+        """Grava apenas os shards alterados (e users.json e o índice, se mudaram)"""
+        self.users = users
+
+        if self.users_dirty:
+            write_json_atomic(self.users_file, users)
+            self.users_dirty = False
+
+        for key in self.dirty:
+            self._write_shard(key)
+        self.dirty.clear()
+        if self.index_dirty:
+            self._write_index()
+
+if __name__ == '__main__':
+    # Migração: python storage.py import-sqlite [users.json] [emails.json] [nayemail.db]
+    if len(sys.argv) >= 2 and sys.argv[1] == 'import-sqlite':
+        args = sys.argv[2:]
+        users_file = args[0] if len(args) > 0 else 'users.json'
+        emails_file = args[1] if len(args) > 1 else 'emails.json'
+        db_file = args[2] if len(args) > 2 else 'nayemail.db'
+
+        source = JournalStorage(users_file, emails_file, 'emails.journal')
+        users, emails = source.load()
+
+        target = SQLiteStorage(db_file)
+        target.import_data(users, emails)
+        print(f"✅ Importados {len(users)} usuários e {len(emails)} emails para {db_file}")
+    else:
+        print("Uso: python storage.py import-sqlite [users.json] [emails.json] [nayemail.db]")
@@ -0,0 +1,83 @@
+"""
+NayEmail - Sequência de alterações por caixa postal (sincronização incremental)
+Cada alteração de mensagem recebe o próximo número de uma sequência monotônica e
+o log de cada caixa guarda só a última alteração de cada mensagem (várias
+alterações da mesma mensagem viram uma). /api/sync?since=N responde com as
+mensagens cujo número passou de N. A sequência começa no horário de início do
+processo (ms), então números de execuções anteriores ficam abaixo do piso e o
+cliente recebe a caixa inteira de novo
+"""
+
+import threading
+import time
+
+
+class ChangeLog:
+    """Log compactado por caixa postal: caixa -> {id: (sequência, excluído)} em ordem de sequência"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries   # entradas por caixa antes de descartar as mais antigas
+        self.lock = threading.Lock()
+        self.logs = {}
+        self.floors = {}   # caixa -> menor 'since' que o log ainda responde (após descartes)
+        self.versions = {} # caixa (ou outra chave) -> número da última alteração
+        self.sequence = 0
+        self.reset()
+
+    def reset(self):
+        """Esquece o histórico (recarga completa): só responde a partir de agora"""
+        with self.lock:
+            self.sequence = max(self.sequence, int(time.time() * 1000))
+            self.start = self.sequence
+            self.logs = {}
+            self.floors = {}
+            self.versions = {}
+
+    def record(self, mailbox, email_id, deleted=False):
+        """Registra a alteração de uma mensagem na caixa; devolve o número da alteração"""
+        with self.lock:
+            self.sequence += 1
+            log = self.logs.setdefault(mailbox, {})
+            log.pop(email_id, None)
+            log[email_id] = (self.sequence, deleted)
+            self.versions[mailbox] = self.sequence
+            if len(log) > self.max_entries:
+                # Descarta a entrada mais antiga: quem sincronizou antes dela recebe tudo
+                oldest = next(iter(log))
+                self.floors[mailbox] = log.pop(oldest)[0]
+            return self.sequence
+
+    def touch(self, key):
+        """Avança a versão de uma chave sem entrada no log (ex.: cadastro de usuários)"""
+        with self.lock:
+            self.sequence += 1
+            self.versions[key] = self.sequence
+            return self.sequence
+
+    def version(self, key):
+        """Número da última alteração da chave (o início do log se não mudou desde então);
+        serve de contador de versão para ETags"""
+        return self.versions.get(key, self.start)
+
+    def changes(self, mailbox, since):
+        """[(id, sequência, excluído)] alterados depois de 'since', em ordem;
+        None se o log não cobre mais esse ponto (cliente precisa da caixa inteira)"""
+        with self.lock:
+            if since < self.floors.get(mailbox, self.start) or since > self.sequence:
+                return None
+
+            result = []
+            for email_id, (sequence, deleted) in reversed(self.logs.get(mailbox, {}).items()):
+                if sequence <= since:
+                    break
+                result.append((email_id, sequence, deleted))
+            result.reverse()
+            return result
+
+    def summary(self):
+        with self.lock:
+            return {
+                'sequence': self.sequence,
+                'mailboxes': len(self.logs),
+                'entries': sum(len(log) for log in self.logs.values())
+            }